@@ -2,75 +2,121 @@ import os
 from PIL import Image
 import numpy as np
 
-list_number = [i for i in range(10)]
-
-for number in list_number:
-    
-    # Define paths for the raw digit images and the processed digit images
-    path_digit = './digits/raw/' + str(number) + '/'
-    path_output = './digits/processed/' + str(number) + '/'
-    
+from digit_bank import bank_source, build_digit_bank_from_mnist
+from digit_cropping import crop_digits, glyph_table
+from mnist_idx import iter_digit_classes, load_mnist, mnist_available
+import profiling
+
+
+def save_cropped_digits(stack, list_img, path_output, number, source=None):
+    """
+    Crop a stack of digits to their left/right bounds and save the results.
+
+    Args:
+        stack (np.array): uint8 array of shape (N, 28, 28) holding the digits of one class.
+        list_img (list): File name used to save each digit.
+        path_output (str): Directory where the cropped digit images are saved.
+        number (int): Class of the digits.
+        source (np.array): Index of each digit in its source (default: position in the stack).
+
+    Returns:
+        np.array: Glyph table of the digits (see digit_cropping.glyph_table).
+    """
     # Create the output directory if it doesn't exist
     os.makedirs(path_output, exist_ok=True)
-    
-    # List all image files in the raw digit directory
-    list_img = os.listdir(path_digit)
-    
-    for img_name in list_img:
-        try:
-            # Open an image file
-            with Image.open(path_digit + img_name) as im:
-                # Convert image to numpy array
-                image_array = np.array(im)
-            
-            # Initialize indices for trimming the image's left and right boundaries
-            left_index = len(image_array) 
-            right_index = 0
-            
-            # Loop through each row of the image array
-            for i in range(len(image_array)):
-                row = image_array[i]
-                
-                # Find indices of pixels with a value greater than 100
-                indices = [i for i, x in enumerate(row) if x > 100]
-                
-                if indices:
-                    first_index = indices[0]
-                    last_index = indices[-1]
-                    
-                    # Adjust the left boundary index if necessary
-                    if first_index < left_index:
-                        if row[first_index-1] > 20:
-                            left_index = first_index-1
-                        else:
-                            left_index = first_index
-                    
-                    # Adjust the right boundary index if necessary
-                    if last_index > right_index:
-                        if row[last_index+1] > 20:
-                            right_index = last_index+1
-                        else:
-                            right_index = last_index
-            
-            # Display the determined left and right indices
-            print('left_index: {}'.format(left_index))
-            print('right_index: {}'.format(right_index))
-
-            # Extract the values between the determined left and right boundaries
-            extracted_values = image_array[:, left_index:right_index]
-            trans_array = extracted_values
-            # Uncomment the following line to invert colors (if needed)
-            # trans_array = 255 - extracted_values
-            
-            # Convert the NumPy array back to an image
-            img = Image.fromarray(trans_array, 'L')  # 'L' indicates grayscale mode. Use 'RGB' for color images.
-            
-            # Save the processed image to the output directory
+
+    # Determine the boundaries, width and ink of all digits in one pass
+    with profiling.stage('crop'):
+        table = glyph_table(stack, number, source, list_img)
+
+    # Save the extracted values between the determined left and right boundaries
+    for img_name, trans_array in zip(list_img, crop_digits(stack, table['left'], table['right'], table['valid'])):
+        if trans_array is None:
+            print('errors occur: {}'.format(img_name))
+            continue
+        # Uncomment the following line to invert colors (if needed)
+        # trans_array = 255 - trans_array
+        with profiling.stage('save'):
+            img = Image.fromarray(np.ascontiguousarray(trans_array), 'L')  # 'L' indicates grayscale mode.
             img.save(path_output + img_name)
-            
-            # Print the shape of the original image array
-            print(image_array.shape)
-        
-        # Handle exceptions
+        profiling.count('digits')
+    return table
+
+
+def process_digit_directory(path_digit, path_output, number):
+    """
+    Crop every digit image of a directory to its left/right bounds and save the result.
+
+    Args:
+        path_digit (str): Directory holding the raw digit images of one class.
+        path_output (str): Directory where the cropped digit images are saved.
+        number (int): Class of the digits.
+
+    Returns:
+        np.array: Glyph table of the digits.
+    """
+    # Load all image files of the raw digit directory into one stack
+    list_img = []
+    list_array = []
+    with profiling.stage('listdir'):
+        list_dir = os.listdir(path_digit)
+    for img_name in list_dir:
+        try:
+            with profiling.stage('decode'), Image.open(path_digit + img_name) as im:
+                list_array.append(np.array(im))
+            list_img.append(img_name)
         except:
             print('errors occur: {}'.format(path_digit + img_name))
+    if not list_array:
+        return glyph_table(np.zeros((0, 28, 28), dtype=np.uint8), number)
+    return save_cropped_digits(np.stack(list_array), list_img, path_output, number)
+
+
+def process_mnist_idx(path_mnist, path_processed, kind='all'):
+    """
+    Crop the digits of the original MNIST IDX files, without a per-digit raw image tree.
+
+    Args:
+        path_mnist (str): Directory holding the (optionally gzipped) IDX files.
+        path_processed (str): Directory where one sub-directory per class is written.
+        kind (str): MNIST split to use: 'train', 't10k' or 'all'.
+
+    Returns:
+        np.array: Glyph table of all the digits.
+    """
+    images, labels = load_mnist(path_mnist, kind)
+    tables = []
+    for number, index, stack in iter_digit_classes(images, labels):
+        list_img = [str(i) + '.jpg' for i in index]
+        tables.append(save_cropped_digits(stack, list_img, path_processed + str(number) + '/', number, index))
+    return np.concatenate(tables)
+
+
+if __name__ == '__main__':
+    path_mnist = './Data/MNIST/'
+    path_processed = './digits/processed/'
+    path_bank = './digits/digit_bank.npz'
+
+    # Set to True to also write every cropped digit of the IDX files as a JPEG (scripts 3 and 4 use the bank)
+    export_jpeg = False
+
+    if mnist_available(path_mnist):
+        # Crop the digits of the IDX files in memory and save them as the digit bank of scripts 3 and 4
+        bank, table = build_digit_bank_from_mnist(path_mnist, return_table=True)
+        bank.source = bank_source(path_processed, path_mnist)
+        os.makedirs(path_processed, exist_ok=True)
+        bank.save(path_bank)
+        if export_jpeg:
+            process_mnist_idx(path_mnist, path_processed)
+    else:
+        list_number = [i for i in range(10)]
+        tables = []
+        for number in list_number:
+            # Define paths for the raw digit images and the processed digit images
+            path_digit = './digits/raw/' + str(number) + '/'
+            path_output = path_processed + str(number) + '/'
+            tables.append(process_digit_directory(path_digit, path_output, number))
+        table = np.concatenate(tables)
+
+    # Save the metadata of every glyph; later steps query it instead of re-reading the images
+    np.save(path_processed + 'glyph_table.npy', table)
@@ -0,0 +1,66 @@
+import functools
+
+from PIL import Image
+import numpy as np
+
+import profiling
+
+# Default number of stretched bars kept by a BarPool
+CACHE_SIZE = 4096
+
+
+class BarPool:
+    """
+    The fraction-bar glyphs of a digit bank, held horizontally with cached stretched variants.
+
+    The bars are the upright "1" glyphs selected by 2_use_1_to_serve_fraction_bar.py
+    (the bank's 'one_as_fraction_bar' class). They are transposed once when the pool is
+    built, and every (bar_id, length) stretch is resized once and then served from a
+    bounded LRU cache.
+
+    Attributes:
+        start (int): Glyph id of the first bar in the bank.
+        bars (list): Horizontal (transposed, contiguous) bar of each glyph id from start.
+    """
+
+    def __init__(self, bank, bar_class='one_as_fraction_bar', cache_size=CACHE_SIZE):
+        self.start, stop = bank.class_range(bar_class)
+        self.bars = [np.ascontiguousarray(bank.glyph(glyph_id).T) for glyph_id in range(self.start, stop)]
+        self.stretched = functools.lru_cache(maxsize=cache_size)(self._stretch)
+
+    def __len__(self):
+        return len(self.bars)
+
+    def horizontal(self, bar_id):
+        """Return the horizontal bar of a glyph id, at its original length."""
+        return self.bars[bar_id - self.start]
+
+    def _stretch(self, bar_id, col_num, thickness=None):
+        """
+        Stretch a bar to col_num pixels; the same pixels as fraction_compositor.resize_bar.
+
+        Only the length of the bar changes, so resizing the transposed glyph along its
+        rows gives exactly the transposed result of resizing the upright glyph.
+        Called through ``self.stretched``, which caches the results.
+
+        Args:
+            bar_id (int): Glyph id of the bar in the bank.
+            col_num (int): Length of the bar in pixels.
+            thickness (int): Also resize the bar to this many rows (default: its own width).
+
+        Returns:
+            np.array: Read-only horizontal bar of shape (thickness or width, col_num).
+        """
+        bar = self.horizontal(bar_id)
+        row_num = bar.shape[0] if thickness is None else int(thickness)
+        with profiling.stage('bar_resize'):
+            stretched = np.asarray(Image.fromarray(bar, 'L').resize((int(col_num), row_num)))
+        stretched.setflags(write=False)
+        return stretched
+
+    def stretcher(self, bar_id):
+        """
+        Return a callable giving the stretched bar for a length, to pass as img_bar to
+        fraction_compositor.compose_a_over_ab / compose_ab_over_ab.
+        """
+        return functools.partial(self.stretched, bar_id)
@@ -0,0 +1,364 @@
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dataset_loader import preprocess_fraction_dataset
+from digit_bank import BAR_CLASS, build_digit_bank_from_arrays
+from digit_cropping import bar_candidates, crop_digits, glyph_table
+from fraction_batch import render_batch
+from mnist_idx import iter_digit_classes
+
+# Relative drop in images/sec that compare_results reports as a regression
+TOLERANCE = 0.1
+
+# Sizes of a full run and of a --quick run
+DEFAULT_CONFIG = {'num_digits': 10000, 'num_fractions': 500, 'repeat': 3, 'seed': 0}
+QUICK_CONFIG = {'num_digits': 2000, 'num_fractions': 100, 'repeat': 2, 'seed': 0}
+
+
+def synthetic_mnist(num_digits, seed=0):
+    """
+    Generate an in-memory stand-in for MNIST: one bright vertical stroke per 28x28 image.
+
+    The strokes of the "1"s are 1 to 6 pixels wide and the others 10 to 18, each with
+    a faint column on both sides, so the cropping rule, the bar filter and the
+    compositor see the same kind of widths as with the real digits. Every two-digit
+    combination fits its fraction, since run_multiple_times_ab_over_ab does not skip
+    the ones that do not.
+
+    Args:
+        num_digits (int): Number of images.
+        seed (int): Seed of the generator.
+
+    Returns:
+        tuple: (images, labels) with images uint8 of shape (num_digits, 28, 28).
+    """
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 10, size=num_digits).astype(np.uint8)
+    widths = np.where(labels == 1, rng.integers(1, 7, size=num_digits), rng.integers(10, 19, size=num_digits))
+    lefts = rng.integers(2, 27 - widths)
+    cols = np.arange(28)[np.newaxis, np.newaxis, :]
+    rows = np.arange(28)[np.newaxis, :, np.newaxis]
+    stroke = (cols >= lefts[:, None, None]) & (cols < (lefts + widths)[:, None, None]) & (rows >= 4) & (rows < 24)
+    edge = ((cols == lefts[:, None, None] - 1) | (cols == (lefts + widths)[:, None, None])) & (rows >= 4) & (rows < 24)
+    images = np.where(stroke, rng.integers(120, 256, size=(num_digits, 28, 28)), np.where(edge, 40, 0))
+    return images.astype(np.uint8), labels
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def measure(fn, repeat, images_per_call, warmup=1):
+    """
+    Time repeated calls of a function.
+
+    Args:
+        fn (callable): Work to time, called without arguments.
+        repeat (int): Timed calls.
+        images_per_call (int): Images produced or processed by one call.
+        warmup (int): Untimed calls made first.
+
+    Returns:
+        dict: Calls, images, seconds, images/sec, latency percentiles of a call (ms) and peak RSS (MB).
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        time_start = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - time_start
+    seconds = float(latencies.sum())
+    p50, p90, p99 = np.percentile(latencies * 1000, [50, 90, 99])
+    return {'calls': repeat, 'images': repeat * images_per_call, 'seconds': seconds,
+            'images_per_sec': repeat * images_per_call / seconds if seconds else 0.0,
+            'latency_ms': {'p50': p50, 'p90': p90, 'p99': p99, 'max': float(latencies.max() * 1000)},
+            'peak_rss_mb': peak_rss_mb()}
+
+
+class _Fixture:
+    """Synthetic data, digit bank and script modules of one stage, built on first use."""
+
+    def __init__(self, config, workdir):
+        self.config = config
+        self.workdir = workdir
+        self._cache = {}
+        random.seed(config['seed'])
+
+    def _get(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    @property
+    def mnist(self):
+        return self._get('mnist', lambda: synthetic_mnist(self.config['num_digits'], self.config['seed']))
+
+    @property
+    def bank(self):
+        return self._get('bank', lambda: build_digit_bank_from_arrays(*self.mnist))
+
+    def script(self, name):
+        return self._get(name, lambda: importlib.import_module(name))
+
+    def path(self, name):
+        """Return a fresh sub-directory of the work directory, ending with '/' like the scripts expect."""
+        path = os.path.join(self.workdir, name) + '/'
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    def cropped_digits(self):
+        """Write the cropped digits like script 1 and return the processed directory."""
+        def build():
+            script_1 = self.script('1_determine_bbox_4_each_digit_in_mnist')
+            path_processed = self.path('processed')
+            for number, index, stack in iter_digit_classes(*self.mnist):
+                list_img = [str(i) + '.jpg' for i in index]
+                script_1.save_cropped_digits(stack, list_img, path_processed + str(number) + '/', number, index)
+            return path_processed
+        return self._get('cropped', build)
+
+    def fractions(self):
+        """Write num_fractions a/b fractions like script 3 and return their directory."""
+        def build():
+            path_result = self.path('fractions')
+            self.script('3_create_simple_fraction_a_over_b').run_multiple_times_a_over_b(
+                self.bank, 4, 9, self.config['num_fractions'], path_result)
+            return path_result
+        return self._get('fractions', build)
+
+
+def _stage_crop(fixture):
+    images, labels = fixture.mnist
+
+    def crop():
+        for number, index, stack in iter_digit_classes(images, labels):
+            table = glyph_table(stack, number, index)
+            crop_digits(stack, table['left'], table['right'], table['valid'])
+    return measure(crop, fixture.config['repeat'], len(images))
+
+
+def _stage_crop_save(fixture):
+    script_1 = fixture.script('1_determine_bbox_4_each_digit_in_mnist')
+    images, labels = fixture.mnist
+    path_processed = fixture.path('processed')
+
+    def crop_save():
+        for number, index, stack in iter_digit_classes(images, labels):
+            list_img = [str(i) + '.jpg' for i in index]
+            script_1.save_cropped_digits(stack, list_img, path_processed + str(number) + '/', number, index)
+    return measure(crop_save, fixture.config['repeat'], len(images))
+
+
+def _stage_bar_query(fixture):
+    images, labels = fixture.mnist
+    table = np.concatenate([glyph_table(stack, number, index)
+                            for number, index, stack in iter_digit_classes(images, labels)])
+    return measure(lambda: bar_candidates(table), fixture.config['repeat'], len(table))
+
+
+def _stage_bar_copy(fixture):
+    script_2 = fixture.script('2_use_1_to_serve_fraction_bar')
+    path_digit = fixture.cropped_digits() + '1/'
+    counter = itertools.count()
+    return measure(lambda: script_2.copy_fraction_bars(path_digit, fixture.path('bars_{}'.format(next(counter)))),
+                   fixture.config['repeat'], len(os.listdir(path_digit)))
+
+
+def _stage_generate(script, function, classes, *extra):
+    def stage(fixture):
+        generate = getattr(fixture.script(script), function)
+        bank = fixture.bank
+        draws = iter([[bank.sample(c) for c in classes] for _ in range(fixture.config['num_fractions'] + 1)])
+
+        def generate_one():
+            glyphs = next(draws)
+            try:
+                generate(*(glyphs + list(extra)))
+            except IndexError:
+                # Same combinations the drivers skip
+                pass
+        return measure(generate_one, fixture.config['num_fractions'], 1)
+    return stage
+
+
+def _stage_run(script, function, *digits):
+    def stage(fixture):
+        run = getattr(fixture.script(script), function)
+        num_fractions = fixture.config['num_fractions']
+        path_result = fixture.path('run')
+        return measure(lambda: run(fixture.bank, *(digits + (num_fractions, path_result))),
+                       fixture.config['repeat'], num_fractions)
+    return stage
+
+
+def _stage_render_batch(spec):
+    def stage(fixture):
+        rng = np.random.default_rng(fixture.config['seed'])
+        num_fractions = fixture.config['num_fractions']
+        return measure(lambda: render_batch(fixture.bank, spec, num_fractions, rng), fixture.config['repeat'],
+                       num_fractions)
+    return stage
+
+
+def _stage_invert(fixture):
+    script_5 = fixture.script('5_invert_colors_of_image_if_needed')
+    path_fractions = fixture.fractions()
+    path_output = os.path.join(fixture.workdir, 'inverted')
+    return measure(lambda: script_5.process_directory(path_fractions, path_output, num_workers=1),
+                   fixture.config['repeat'], len(os.listdir(path_fractions)))
+
+
+def _stage_load(path_cache):
+    def stage(fixture):
+        path_fractions = fixture.fractions()
+        cache = None if path_cache is None else os.path.join(fixture.workdir, path_cache)
+        return measure(lambda: preprocess_fraction_dataset(path_fractions, num_workers=1, path_cache=cache),
+                       fixture.config['repeat'], len(os.listdir(path_fractions)))
+    return stage
+
+
+# Every benchmarked stage, in the order of the pipeline
+STAGES = {
+    'crop': _stage_crop,
+    'crop_save_jpeg': _stage_crop_save,
+    'bar_select_query': _stage_bar_query,
+    'bar_select_copy': _stage_bar_copy,
+    'generate_a_over_b': _stage_generate('3_create_simple_fraction_a_over_b', 'generate_fraction_array_a_over_b',
+                                         [4, 9, BAR_CLASS]),
+    'generate_a_over_ab': _stage_generate('4_create_complex_fraction_a_over_ab', 'generate_fraction_array_a_over_ab',
+                                          [4, 9, 2, BAR_CLASS], 1),
+    'generate_ab_over_ab': _stage_generate('4_create_complex_fraction_ab_over_ab',
+                                           'generate_fraction_array_ab_over_ab', [4, 1, 9, 2, BAR_CLASS], 1),
+    'run_a_over_b': _stage_run('3_create_simple_fraction_a_over_b', 'run_multiple_times_a_over_b', 4, 9),
+    'run_a_over_ab': _stage_run('4_create_complex_fraction_a_over_ab', 'run_multiple_times_a_over_ab', 4, 9, 2, 1),
+    'run_ab_over_ab': _stage_run('4_create_complex_fraction_ab_over_ab', 'run_multiple_times_ab_over_ab',
+                                 4, 1, 9, 2, 1),
+    'render_batch_a_over_b': _stage_render_batch('4/9'),
+    'render_batch_a_over_ab': _stage_render_batch('4/92'),
+    'render_batch_ab_over_ab': _stage_render_batch('41/92'),
+    'invert': _stage_invert,
+    'load_notebook': _stage_load(None),
+    'load_cached': _stage_load('cache'),
+}
+
+
+def run_stage(name, config):
+    """
+    Run one stage in a temporary directory.
+
+    Args:
+        name (str): Key of STAGES.
+        config (dict): Sizes, see DEFAULT_CONFIG.
+
+    Returns:
+        dict: Result of measure.
+    """
+    workdir = tempfile.mkdtemp(prefix='fraction_bench_')
+    try:
+        return STAGES[name](_Fixture(config, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_benchmarks(names=None, config=None, isolate=True):
+    """
+    Run stages and collect their results.
+
+    With isolate=True every stage runs in a freshly spawned process, so its peak RSS
+    is its own and not the high-water mark of the stages before it.
+
+    Args:
+        names (list): Stages to run (all of STAGES by default).
+        config (dict): Sizes, see DEFAULT_CONFIG.
+        isolate (bool): Run each stage in its own process.
+
+    Returns:
+        dict: {'meta': run information, 'stages': result of every stage}.
+    """
+    config = dict(DEFAULT_CONFIG if config is None else config)
+    results = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                        'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                        'config': config},
+               'stages': {}}
+    for name in names or list(STAGES):
+        if isolate:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_stage, name, config).result()
+        else:
+            result = run_stage(name, config)
+        results['stages'][name] = result
+        print(format_result(name, result))
+    return results
+
+
+def format_result(name, result):
+    """Format one stage result as a line of the report."""
+    latency = result['latency_ms']
+    return '{:<24} {:>10.0f} img/s   p50 {:>9.3f} ms   p99 {:>9.3f} ms   peak RSS {:>7.1f} MB'.format(
+        name, result['images_per_sec'], latency['p50'], latency['p99'], result['peak_rss_mb'])
+
+
+def compare_results(baseline, current, tolerance=TOLERANCE):
+    """
+    Find the stages whose throughput dropped since a baseline run.
+
+    Args:
+        baseline (dict): Results of an earlier run_benchmarks.
+        current (dict): Results of this run.
+        tolerance (float): Relative drop in images/sec that counts as a regression.
+
+    Returns:
+        list: (stage, baseline images/sec, current images/sec, relative change) of every regression.
+    """
+    regressions = []
+    for name, result in current['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        before = baseline['stages'][name]['images_per_sec']
+        after = result['images_per_sec']
+        change = (after - before) / before if before else 0.0
+        if change < -tolerance:
+            regressions.append((name, before, after, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the fraction generation pipeline on synthetic MNIST.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help='stages to run (default: all)')
+    parser.add_argument('--quick', action='store_true', help='small sizes, for a smoke test')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file of the results')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='relative slowdown reported as a regression')
+    parser.add_argument('--no-isolate', action='store_true', help='run every stage in this process')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.stages, QUICK_CONFIG if args.quick else DEFAULT_CONFIG, not args.no_isolate)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.tolerance)
+        for name, before, after, change in regressions:
+            print('REGRESSION {}: {:.0f} -> {:.0f} img/s ({:+.1%})'.format(name, before, after, change))
+        sys.exit(1 if regressions else 0)
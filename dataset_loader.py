@@ -0,0 +1,269 @@
+import hashlib
+import io
+import os
+import re
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+import numpy as np
+
+# Default directory of the cached tensors; pass path_cache=None to disable caching
+CACHE_DIR = './.dataset_cache/'
+
+# Number of files decoded per thread task
+CHUNK_SIZE = 256
+
+# Members of an archive read by load_archive
+ARCHIVE_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# File names written by the generation scripts, e.g. '4_over_92_id_3.jpg'
+FRACTION_NAME = re.compile(r'^(\d+)_over_(\d+)_id_(\d+)$', re.MULTILINE)
+
+
+def parse_fraction_labels(filenames):
+    """
+    Extract the labels of fraction images from their file names.
+
+    Gives the same result as the notebook (every all-digit part of the name before the
+    first '.', split on '_'): '4_over_92_id_3.jpg' gives [4, 92, 3]. Names written by the
+    generation scripts are parsed in one regular-expression pass over all of them.
+
+    Args:
+        filenames (list): File names (without directory).
+
+    Returns:
+        np.array: int64 array of shape (n, k), or an object array if the names have different numbers of parts.
+    """
+    stems = [name.split('.')[0] for name in filenames]
+    matches = FRACTION_NAME.findall('\n'.join(stems))
+    if len(matches) == len(stems):
+        return np.array(matches).astype(np.int64).reshape(len(stems), 3)
+
+    labels = [[int(part) for part in stem.split('_') if part.isdigit()] for stem in stems]
+    if len(set(len(label) for label in labels)) <= 1:
+        return np.array(labels, dtype=np.int64).reshape(len(labels), -1)
+    out = np.empty(len(labels), dtype=object)
+    out[:] = labels
+    return out
+
+
+def _decode_chunk(out, paths, start, image_size):
+    for i, file_path in enumerate(paths):
+        with Image.open(file_path) as img:
+            img = img.convert('L')  # Convert to grayscale
+            img = img.resize(image_size)  # Resize image
+            out[start + i] = np.asarray(img)
+
+
+def decode_images(paths, image_size=(28, 28), num_workers=None):
+    """
+    Decode, convert to grayscale and resize images across a thread pool.
+
+    Every thread writes straight into one preallocated float32 array, which is then
+    normalized to [0, 1] in place.
+
+    Args:
+        paths (list): Image files.
+        image_size (tuple): (width, height) passed to PIL's resize.
+        num_workers (int): Threads; None uses one per core.
+
+    Returns:
+        np.array: float32 array of shape (n, height, width).
+    """
+    out = np.empty((len(paths), image_size[1], image_size[0]), dtype=np.float32)
+    with ThreadPoolExecutor(num_workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_decode_chunk, out, paths[start:start + CHUNK_SIZE], start, image_size)
+                   for start in range(0, len(paths), CHUNK_SIZE)]
+        for future in futures:
+            future.result()
+    out /= 255.0
+    return out
+
+
+def _cache_key(kind, root, paths, image_size):
+    """Hash the relative path, size and mtime of every file, so any change to the folder invalidates the cache."""
+    digest = hashlib.sha1('{} {}x{}'.format(kind, *image_size).encode())
+    for file_path in paths:
+        stat = os.stat(file_path)
+        digest.update('{}\0{}\0{}\n'.format(os.path.relpath(file_path, root), stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+def _cached(key, load_fn, path_cache):
+    """Return (images, labels) from the cache entry key, calling load_fn and filling the cache on a miss."""
+    path_images = os.path.join(path_cache, key + '.images.npy')
+    path_labels = os.path.join(path_cache, key + '.labels.npy')
+    if os.path.exists(path_images) and os.path.exists(path_labels):
+        return np.load(path_images, mmap_mode='r'), np.load(path_labels, allow_pickle=True)
+
+    images, labels = load_fn()
+    os.makedirs(path_cache, exist_ok=True)
+    for path, array in ((path_labels, labels), (path_images, images)):
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+    return images, labels
+
+
+def _load_cached(kind, root, paths, labels_fn, image_size, num_workers, path_cache):
+    """Return (images, labels) from the cache, decoding the files and filling the cache on a miss."""
+    if path_cache is None:
+        return decode_images(paths, image_size, num_workers), labels_fn()
+    return _cached(_cache_key(kind, root, paths, image_size),
+                   lambda: (decode_images(paths, image_size, num_workers), labels_fn()), path_cache)
+
+
+def preprocess_fraction_dataset(folder_path, image_size=(28, 28), num_workers=None, path_cache=CACHE_DIR):
+    """
+    Load a flat folder of fraction images, labelled by their file names.
+
+    Drop-in replacement for the notebook function of the same name. Files are read
+    in sorted order; the result is cached under path_cache and reloaded
+    (memory-mapped) as long as no file of the folder changes.
+
+    Args:
+        folder_path (str): Folder holding the images, e.g. 'data/fraction'.
+        image_size (tuple): (width, height) of the output images.
+        num_workers (int): Decoding threads; None uses one per core.
+        path_cache (str): Cache directory, or None to disable caching.
+
+    Returns:
+        tuple: (images, labels) with images float32 of shape (n, height, width) in [0, 1].
+    """
+    filenames = sorted(f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f)))
+    paths = [os.path.join(folder_path, f) for f in filenames]
+    return _load_cached('fraction', folder_path, paths, lambda: parse_fraction_labels(filenames),
+                        image_size, num_workers, path_cache)
+
+
+def preprocess_dataset(data_folder, image_size=(28, 28), num_workers=None, path_cache=CACHE_DIR):
+    """
+    Load a folder with one sub-folder per class, labelled by the sub-folder names.
+
+    Drop-in replacement for the notebook function of the same name, with the same
+    threading and caching as preprocess_fraction_dataset.
+
+    Args:
+        data_folder (str): Folder holding one sub-folder per class, e.g. 'data/'.
+        image_size (tuple): (width, height) of the output images.
+        num_workers (int): Decoding threads; None uses one per core.
+        path_cache (str): Cache directory, or None to disable caching.
+
+    Returns:
+        tuple: (images, labels) with images float32 of shape (n, height, width) and the class names as labels.
+    """
+    paths = []
+    class_names = []
+    counts = []
+    for class_name in sorted(os.listdir(data_folder)):
+        class_folder = os.path.join(data_folder, class_name)
+        if not os.path.isdir(class_folder):
+            continue
+        files = [os.path.join(class_folder, f) for f in sorted(os.listdir(class_folder))]
+        files = [f for f in files if os.path.isfile(f)]
+        paths.extend(files)
+        class_names.append(class_name)
+        counts.append(len(files))
+    return _load_cached('classes', data_folder, paths, lambda: np.repeat(np.array(class_names), counts),
+                        image_size, num_workers, path_cache)
+
+
+def iter_archive(path_archive):
+    """
+    Stream the image files of a zip or tar archive (plain, gzip, bz2 or xz) without extracting it.
+
+    A tar archive is read front to back in one pass, so compressed tars are never
+    decompressed twice or to disk.
+
+    Args:
+        path_archive (str): Archive file, e.g. 'Data/MathFraction/fraction.gz' or 'validation.zip'.
+
+    Yields:
+        tuple: (name, data) of every image member, in archive order, with data the encoded file bytes.
+    """
+    if zipfile.is_zipfile(path_archive):
+        with zipfile.ZipFile(path_archive) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(ARCHIVE_IMAGE_EXTENSIONS):
+                    yield info.filename, archive.read(info)
+        return
+
+    with tarfile.open(path_archive, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(ARCHIVE_IMAGE_EXTENSIONS):
+                yield member.name, archive.extractfile(member).read()
+
+
+def _decode_blobs(blobs, image_size):
+    out = np.empty((len(blobs), image_size[1], image_size[0]), dtype=np.uint8)
+    for i, data in enumerate(blobs):
+        with Image.open(io.BytesIO(data)) as img:
+            out[i] = np.asarray(img.convert('L').resize(image_size))
+    return out
+
+
+def decode_archive(path_archive, image_size=(28, 28), num_workers=None):
+    """
+    Decode every image of an archive across a thread pool while the archive is still being read.
+
+    Args:
+        path_archive (str): Zip or tar archive.
+        image_size (tuple): (width, height) passed to PIL's resize.
+        num_workers (int): Threads; None uses one per core.
+
+    Returns:
+        tuple: (names, images) with the member names in sorted order and images float32 of
+        shape (n, height, width) in [0, 1], as decode_images gives for the extracted files.
+    """
+    names = []
+    futures = []
+    with ThreadPoolExecutor(num_workers or os.cpu_count()) as executor:
+        blobs = []
+        for name, data in iter_archive(path_archive):
+            names.append(name)
+            blobs.append(data)
+            if len(blobs) == CHUNK_SIZE:
+                futures.append(executor.submit(_decode_blobs, blobs, image_size))
+                blobs = []
+        if blobs:
+            futures.append(executor.submit(_decode_blobs, blobs, image_size))
+        chunks = [future.result() for future in futures]
+
+    # Same order as the folder loaders, which read the extracted files sorted by name
+    order = sorted(range(len(names)), key=names.__getitem__)
+    images = np.empty((len(names), image_size[1], image_size[0]), dtype=np.float32)
+    if chunks:
+        images[:] = np.concatenate(chunks)[order]
+    images /= 255.0
+    return [names[i] for i in order], images
+
+
+def load_archive(path_archive, image_size=(28, 28), num_workers=None, path_cache=CACHE_DIR):
+    """
+    Load the fraction images of an archive, labelled by their file names, without extracting it.
+
+    Gives the same arrays as preprocess_fraction_dataset on the extracted folder. The
+    first load is cached under path_cache; later loads memory-map the cache and are
+    instant until the archive changes.
+
+    Args:
+        path_archive (str): Zip or tar archive, e.g. 'Data/MathFraction/fraction.gz'.
+        image_size (tuple): (width, height) of the output images.
+        num_workers (int): Decoding threads; None uses one per core.
+        path_cache (str): Cache directory, or None to disable caching.
+
+    Returns:
+        tuple: (images, labels) with images float32 of shape (n, height, width) in [0, 1].
+    """
+    def load():
+        names, images = decode_archive(path_archive, image_size, num_workers)
+        return images, parse_fraction_labels([os.path.basename(name) for name in names])
+
+    if path_cache is None:
+        return load()
+    stat = os.stat(path_archive)
+    key = hashlib.sha1('archive {}x{} {}\0{}\0{}'.format(image_size[0], image_size[1], os.path.basename(path_archive),
+                                                          stat.st_size, stat.st_mtime_ns).encode()).hexdigest()
+    return _cached(key, load, path_cache)
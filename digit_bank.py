@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+import random
+
+from PIL import Image
+import numpy as np
+
+from bar_pool import BarPool
+from digit_cropping import bar_candidates, crop_digits, glyph_table
+from mnist_idx import MNIST_FILES, find_idx_file, iter_digit_classes, load_mnist, mnist_available
+import profiling
+
+# Name of the class holding the upright "1" glyphs used as fraction bars
+BAR_CLASS = 'one_as_fraction_bar'
+
+
+class DigitBank:
+    """
+    All cropped digit glyphs packed into one contiguous uint8 buffer.
+
+    Glyphs are grouped by class, so each class is a contiguous range of glyph ids
+    and drawing a random glyph is an O(1) slice of the buffer.
+
+    Attributes:
+        buffer (np.array): Flat uint8 buffer holding every glyph row by row.
+        offsets (np.array): Start of each glyph in the buffer.
+        heights (np.array): Number of rows of each glyph.
+        widths (np.array): Number of columns of each glyph.
+        class_names (list): Name of each class ('0' to '9' and 'one_as_fraction_bar').
+        class_starts (np.array): First glyph id of each class.
+        class_stops (np.array): One past the last glyph id of each class.
+        source (str): Fingerprint of the files the bank was built from (see bank_source), or None.
+    """
+
+    def __init__(self, buffer, offsets, heights, widths, class_names, class_starts, class_stops, source=None):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.heights = heights
+        self.widths = widths
+        self.class_names = [str(name) for name in class_names]
+        self.class_starts = class_starts
+        self.class_stops = class_stops
+        self.source = source
+        self._class_index = {name: i for i, name in enumerate(self.class_names)}
+        self._bar_pool = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def class_range(self, number):
+        """
+        Return the (start, stop) glyph ids of a class.
+
+        Args:
+            number (int or str): Digit or class name, e.g. 4 or 'one_as_fraction_bar'.
+        """
+        i = self._class_index[str(number)]
+        return int(self.class_starts[i]), int(self.class_stops[i])
+
+    @property
+    def bar_pool(self):
+        """The fraction bars of the bank as a BarPool, built on first use."""
+        if self._bar_pool is None:
+            self._bar_pool = BarPool(self, BAR_CLASS)
+        return self._bar_pool
+
+    def count(self, number):
+        """Return the number of glyphs stored for a class."""
+        start, stop = self.class_range(number)
+        return stop - start
+
+    def glyph(self, glyph_id):
+        """
+        Return a glyph as a (height, width) view on the buffer.
+
+        Args:
+            glyph_id (int): Position of the glyph in the bank.
+
+        Returns:
+            np.array: uint8 array of the glyph (not a copy).
+        """
+        offset = self.offsets[glyph_id]
+        height = self.heights[glyph_id]
+        width = self.widths[glyph_id]
+        return self.buffer[offset:offset + height * width].reshape(height, width)
+
+    def sample_id(self, number, rng=random):
+        """
+        Draw the id of a random glyph of a class.
+
+        Args:
+            number (int or str): Digit or class name.
+            rng: Object with a ``randrange`` method (the ``random`` module by default).
+        """
+        start, stop = self.class_range(number)
+        return start + rng.randrange(stop - start)
+
+    def sample(self, number, rng=random):
+        """Draw a random glyph of a class and return it as an array."""
+        return self.glyph(self.sample_id(number, rng))
+
+    def save(self, path_bank):
+        """
+        Save the bank as a single uncompressed .npz file, with its source fingerprint if it has one.
+
+        Args:
+            path_bank (str): Destination file.
+        """
+        arrays = {} if self.source is None else {'source': np.array(self.source)}
+        np.savez(path_bank, buffer=self.buffer, offsets=self.offsets, heights=self.heights, widths=self.widths,
+                 class_names=np.array(self.class_names), class_starts=self.class_starts, class_stops=self.class_stops,
+                 **arrays)
+
+
+def pack_digit_bank(glyphs_by_class):
+    """
+    Pack lists of glyph arrays into a DigitBank.
+
+    Args:
+        glyphs_by_class (dict): Maps each class name to a list of 2D uint8 arrays.
+
+    Returns:
+        DigitBank: The packed bank.
+    """
+    class_names = list(glyphs_by_class)
+    glyphs = [g for name in class_names for g in glyphs_by_class[name]]
+    counts = np.array([len(glyphs_by_class[name]) for name in class_names], dtype=np.int64)
+
+    heights = np.array([g.shape[0] for g in glyphs], dtype=np.int64)
+    widths = np.array([g.shape[1] for g in glyphs], dtype=np.int64)
+    sizes = heights * widths
+    offsets = np.zeros(len(glyphs), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=offsets[1:])
+
+    # Copy every glyph into its place in the contiguous buffer
+    buffer = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for glyph, offset, size in zip(glyphs, offsets, sizes):
+        buffer[offset:offset + size] = glyph.ravel()
+
+    class_stops = np.cumsum(counts)
+    class_starts = class_stops - counts
+    return DigitBank(buffer, offsets, heights, widths, class_names, class_starts, class_stops)
+
+
+def build_digit_bank_from_directory(path_data):
+    """
+    Build a bank from the tree written by scripts 1 and 2 (one directory per class).
+
+    Without a fraction bar directory, the bars are the "1" images selected by
+    bar_candidates on the 'glyph_table.npy' saved by script 1.
+
+    Args:
+        path_data (str): Directory of the individual processed MNIST data, e.g. './digits/processed/'.
+
+    Returns:
+        DigitBank: Bank holding every readable glyph of classes 0-9 and the fraction bars.
+    """
+    glyphs_by_class = {}
+    for name in [str(i) for i in range(10)] + [BAR_CLASS]:
+        path_class = path_data + name + '/'
+        if not os.path.isdir(path_class):
+            continue
+        glyphs = []
+        with profiling.stage('listdir'):
+            list_img = sorted(os.listdir(path_class))
+        for img_name in list_img:
+            with profiling.stage('decode'), Image.open(path_class + img_name) as im:
+                glyphs.append(np.array(im))
+        glyphs_by_class[name] = glyphs
+
+    path_table = path_data + 'glyph_table.npy'
+    if BAR_CLASS not in glyphs_by_class and '1' in glyphs_by_class and os.path.exists(path_table):
+        table = np.load(path_table)
+        bar_names = set(table['name'][bar_candidates(table)])
+        names = sorted(os.listdir(path_data + '1/'))
+        glyphs_by_class[BAR_CLASS] = [g for g, n in zip(glyphs_by_class['1'], names) if n in bar_names]
+    return pack_digit_bank(glyphs_by_class)
+
+
+def build_digit_bank_from_arrays(images, labels, bar_max_width=5, return_table=False):
+    """
+    Build a bank from in-memory MNIST-style digits, cropping them in memory.
+
+    Args:
+        images (np.array): uint8 array of shape (N, 28, 28).
+        labels (np.array): Digit of each image.
+        bar_max_width (int): Cropped "1" glyphs narrower than this serve as fraction bars.
+        return_table (bool): Also return the glyph table of the digits, as saved by script 1.
+
+    Returns:
+        DigitBank: Bank holding the cropped glyphs of classes 0-9 and the fraction bars,
+        or (bank, glyph table) with return_table.
+    """
+    glyphs_by_class = {}
+    tables = []
+    for number, index, stack in iter_digit_classes(images, labels):
+        table = glyph_table(stack, number, index, [str(i) + '.jpg' for i in index])
+        tables.append(table)
+        glyphs = crop_digits(stack, table['left'], table['right'], table['valid'])
+        glyphs_by_class[str(number)] = [g for g in glyphs if g is not None]
+        if number == 1:
+            # Same filter as 2_use_1_to_serve_fraction_bar.py, as a query on the glyph table
+            bars = bar_candidates(table, bar_max_width)
+            glyphs_by_class[BAR_CLASS] = [g for g, is_bar in zip(glyphs, bars) if is_bar]
+    bank = pack_digit_bank(glyphs_by_class)
+    if return_table:
+        return bank, np.concatenate(tables)
+    return bank
+
+
+def build_digit_bank_from_mnist(path_mnist, kind='all', bar_max_width=5, return_table=False):
+    """
+    Build a bank straight from the MNIST IDX files, cropping the digits in memory.
+
+    Args:
+        path_mnist (str): Directory holding the (optionally gzipped) IDX files.
+        kind (str): MNIST split to use: 'train', 't10k' or 'all'.
+        bar_max_width (int): Cropped "1" glyphs narrower than this serve as fraction bars.
+        return_table (bool): Also return the glyph table of the digits, as saved by script 1.
+
+    Returns:
+        DigitBank: Bank holding the cropped glyphs of classes 0-9 and the fraction bars,
+        or (bank, glyph table) with return_table.
+    """
+    images, labels = load_mnist(path_mnist, kind)
+    return build_digit_bank_from_arrays(images, labels, bar_max_width, return_table)
+
+
+def load_digit_bank(path_bank):
+    """
+    Load a bank saved with DigitBank.save.
+
+    Args:
+        path_bank (str): Path to the .npz file.
+
+    Returns:
+        DigitBank: The loaded bank.
+    """
+    with np.load(path_bank) as data:
+        source = str(data['source']) if 'source' in data.files else None
+        return DigitBank(data['buffer'], data['offsets'], data['heights'], data['widths'],
+                         list(data['class_names']), data['class_starts'], data['class_stops'], source)
+
+
+def _fingerprint(kind, path, files):
+    """Hash the names, sizes and modification times of some files or directories into a JSON string."""
+    digest = hashlib.sha1()
+    for name, path_file in sorted(files):
+        stat = os.stat(path_file)
+        digest.update('{}\0{}\0{}\n'.format(name, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    return json.dumps({'kind': kind, 'path': os.path.abspath(path), 'files': len(files),
+                       'digest': digest.hexdigest()})
+
+
+def bank_source(path_data, path_mnist=None):
+    """
+    Fingerprint the files get_digit_bank would build a bank from.
+
+    That is the MNIST IDX files when they are in path_mnist, and otherwise the class
+    directories and the glyph table in path_data (names, sizes and modification times).
+    Only the directories are stat'ed, so adding, removing or renaming a glyph changes
+    the fingerprint but rewriting one in place does not; delete the bank file then.
+
+    Args:
+        path_data (str): Directory of the individual processed MNIST data.
+        path_mnist (str): Optional directory holding the MNIST IDX files.
+
+    Returns:
+        str: Fingerprint to compare with DigitBank.source, or None when neither source exists.
+    """
+    if path_mnist is not None and mnist_available(path_mnist):
+        names = [name for pair in MNIST_FILES.values() for name in pair]
+        return _fingerprint('mnist', path_mnist, [(name, find_idx_file(path_mnist, name)) for name in names])
+    if not os.path.isdir(path_data):
+        return None
+    # Stat the class directories rather than their ~70k files: adding, removing or
+    # renaming a glyph updates the modification time of its directory
+    files = [(name, path_data + name) for name in [str(i) for i in range(10)] + [BAR_CLASS]
+             if os.path.isdir(path_data + name)]
+    if os.path.exists(path_data + 'glyph_table.npy'):
+        files.append(('glyph_table.npy', path_data + 'glyph_table.npy'))
+    return _fingerprint('directory', path_data, files)
+
+
+def get_digit_bank(path_bank, path_data, path_mnist=None):
+    """
+    Load the bank from path_bank, building and saving it when it is missing or out of date.
+
+    The bank is built from the MNIST IDX files when they are in path_mnist, and from
+    the processed digit tree in path_data otherwise. A saved bank is rebuilt when the
+    fingerprint of these files (see bank_source) differs from the one saved with it;
+    without any source files it is used as is.
+
+    Args:
+        path_bank (str): Path to the bank file.
+        path_data (str): Directory of the individual processed MNIST data.
+        path_mnist (str): Optional directory holding the MNIST IDX files.
+
+    Returns:
+        DigitBank: The loaded bank.
+    """
+    source = bank_source(path_data, path_mnist)
+    if os.path.exists(path_bank):
+        bank = load_digit_bank(path_bank)
+        if source is None or bank.source == source:
+            return bank
+    if path_mnist is not None and mnist_available(path_mnist):
+        bank = build_digit_bank_from_mnist(path_mnist)
+    else:
+        bank = build_digit_bank_from_directory(path_data)
+    bank.source = source
+    bank.save(path_bank)
+    return load_digit_bank(path_bank)
@@ -0,0 +1,202 @@
+import numpy as np
+
+
+def _scan_bounds(stack, ink_threshold, edge_threshold):
+    """
+    Apply the row-by-row trimming rule of the bbox script to a whole stack at once.
+
+    The rule is sequential over the rows of an image (a row only moves a boundary
+    if its first/last ink pixel lies beyond the current one), so the loop runs over
+    the rows while every comparison is vectorized across all N images.
+
+    Args:
+        stack (np.array): Array of shape (N, rows, cols) holding the digit images.
+        ink_threshold (int): Pixels brighter than this value count as ink.
+        edge_threshold (int): A neighbouring pixel brighter than this value widens the boundary by one.
+
+    Returns:
+        tuple: (start, stop, valid) arrays of shape (N,). ``stop`` is used as an
+        exclusive slice bound, exactly like ``image_array[:, left_index:right_index]``.
+        ``valid`` is False for images the original loop could not crop.
+    """
+    num_img, num_rows, num_cols = stack.shape
+    image_ids = np.arange(num_img)
+
+    # Initialize indices the same way as the script: start at len(image_array), stop at 0
+    start = np.full(num_img, num_rows, dtype=np.int64)
+    stop = np.zeros(num_img, dtype=np.int64)
+    overflow = np.zeros(num_img, dtype=bool)
+
+    for idx_r in range(num_rows):
+        rows = stack[:, idx_r, :]
+        ink = rows > ink_threshold
+        has_ink = ink.any(axis=1)
+
+        # First and last pixel above the ink threshold in this row
+        first_index = np.argmax(ink, axis=1)
+        last_index = num_cols - 1 - np.argmax(ink[:, ::-1], axis=1)
+
+        # Adjust the left boundary; row[first_index-1] wraps around for first_index 0
+        move_left = has_ink & (first_index < start)
+        left_edge = rows[image_ids, (first_index - 1) % num_cols] > edge_threshold
+        start = np.where(move_left, first_index - left_edge, start)
+
+        # Adjust the right boundary; row[last_index+1] is out of range on the last column
+        move_right = has_ink & (last_index > stop)
+        overflow |= move_right & (last_index == num_cols - 1)
+        right_edge = rows[image_ids, np.minimum(last_index + 1, num_cols - 1)] > edge_threshold
+        stop = np.where(move_right, last_index + (right_edge & (last_index < num_cols - 1)), stop)
+
+    # Python slice semantics: a negative start counts from the end of the row
+    slice_start = np.where(start < 0, start + num_cols, start)
+    valid = ~overflow & (stop > slice_start)
+    return start, stop, valid
+
+
+def compute_bounds(stack, ink_threshold=100, edge_threshold=20):
+    """
+    Compute the left/right and top/bottom bounds of every digit in a stack.
+
+    Left/right follow the threshold rule of 1_determine_bbox_4_each_digit_in_mnist.py;
+    top/bottom apply the same rule to the columns of each image. ``valid`` only
+    reflects the left/right rule, i.e. whether the script would have saved the digit.
+
+    Args:
+        stack (np.array): uint8 array of shape (N, 28, 28) (a single (28, 28) image is also accepted).
+        ink_threshold (int): Pixels brighter than this value count as ink (default 100).
+        edge_threshold (int): Neighbour value that widens the boundary by one pixel (default 20).
+
+    Returns:
+        tuple: (left, right, top, bottom, valid) arrays of shape (N,).
+    """
+    stack = np.asarray(stack)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+
+    left, right, valid = _scan_bounds(stack, ink_threshold, edge_threshold)
+    top, bottom, _ = _scan_bounds(stack.transpose(0, 2, 1), ink_threshold, edge_threshold)
+    return left, right, top, bottom, valid
+
+
+def crop_digits(stack, left, right, valid=None):
+    """
+    Trim every digit of a stack to its left/right bounds.
+
+    Args:
+        stack (np.array): uint8 array of shape (N, rows, cols).
+        left (np.array): Left bounds returned by compute_bounds.
+        right (np.array): Right bounds returned by compute_bounds.
+        valid (np.array): Optional mask; invalid digits are returned as None.
+
+    Returns:
+        list: One (rows, width) view per digit (or None where the digit is invalid).
+    """
+    if valid is None:
+        valid = np.ones(len(stack), dtype=bool)
+    return [image_array[:, l:r] if ok else None for image_array, l, r, ok in zip(stack, left, right, valid)]
+
+
+# One row per glyph of the cropping pass: where it comes from, its bounds and its ink
+GLYPH_DTYPE = np.dtype([('label', '<i2'), ('source', '<i8'), ('name', '<U32'), ('valid', '?'),
+                        ('left', '<i4'), ('right', '<i4'), ('top', '<i4'), ('bottom', '<i4'),
+                        ('width', '<i4'), ('height', '<i4'), ('ink_mass', '<i8')])
+
+
+def glyph_table(stack, labels, source=None, names=None, ink_threshold=100, edge_threshold=20):
+    """
+    Crop bounds and metadata of every digit of a stack, as a structured array.
+
+    The table is computed in the same vectorized pass as compute_bounds, so that
+    subsets of glyphs (fraction bars, width buckets, ...) are selected by queries on
+    it instead of re-reading the cropped images.
+
+    Args:
+        stack (np.array): uint8 array of shape (N, 28, 28).
+        labels (np.array or int): Class of each digit, or one class for the whole stack.
+        source (np.array): Index of each digit in its source (default: position in the stack).
+        names (list): File name of each digit (default: empty).
+        ink_threshold (int): Pixels brighter than this value count as ink (default 100).
+        edge_threshold (int): Neighbour value that widens the boundary by one pixel (default 20).
+
+    Returns:
+        np.array: Structured array of dtype GLYPH_DTYPE. ``width`` and ``ink_mass`` (sum
+        of the pixel values) describe the cropped glyph ``image[:, left:right]``.
+    """
+    stack = np.asarray(stack)
+    left, right, top, bottom, valid = compute_bounds(stack, ink_threshold, edge_threshold)
+
+    table = np.zeros(len(stack), dtype=GLYPH_DTYPE)
+    table['label'] = labels
+    table['source'] = np.arange(len(stack)) if source is None else source
+    if names is not None:
+        table['name'] = names
+    table['valid'] = valid
+    table['left'] = left
+    table['right'] = right
+    table['top'] = top
+    table['bottom'] = bottom
+    table['width'] = np.where(valid, right - left, 0)
+    table['height'] = stack.shape[1]
+
+    # Ink mass of the columns left:right from a cumulative sum over the columns
+    col_sums = np.zeros((len(stack), stack.shape[2] + 1), dtype=np.int64)
+    np.cumsum(stack.sum(axis=1, dtype=np.int64), axis=1, out=col_sums[:, 1:])
+    ids = np.arange(len(stack))
+    table['ink_mass'] = np.where(valid, col_sums[ids, np.clip(right, 0, None)] - col_sums[ids, np.clip(left, 0, None)], 0)
+    return table
+
+
+def select_glyphs(table, label=None, min_width=None, max_width=None, valid_only=True):
+    """
+    Select rows of a glyph table.
+
+    Args:
+        table (np.array): Table returned by glyph_table.
+        label (int): Keep only this class.
+        min_width (int): Keep glyphs at least this wide.
+        max_width (int): Keep glyphs narrower than this (exclusive, like the bar filter).
+        valid_only (bool): Drop the digits the cropping rule could not crop.
+
+    Returns:
+        np.array: Boolean mask over the rows of the table.
+    """
+    mask = np.ones(len(table), dtype=bool)
+    if valid_only:
+        mask &= table['valid']
+    if label is not None:
+        mask &= table['label'] == label
+    if min_width is not None:
+        mask &= table['width'] >= min_width
+    if max_width is not None:
+        mask &= table['width'] < max_width
+    return mask
+
+
+def bar_candidates(table, max_width=5):
+    """
+    Select the upright "1" glyphs that serve as fraction bars (the filter of 2_use_1_to_serve_fraction_bar.py).
+
+    Args:
+        table (np.array): Table returned by glyph_table.
+        max_width (int): Cropped "1" glyphs narrower than this qualify.
+
+    Returns:
+        np.array: Boolean mask over the rows of the table.
+    """
+    return select_glyphs(table, label=1, max_width=max_width)
+
+
+def width_buckets(table, edges):
+    """
+    Group the valid glyphs of a table by width.
+
+    Args:
+        table (np.array): Table returned by glyph_table.
+        edges (list): Increasing bucket edges, e.g. [0, 8, 12, 16, 29].
+
+    Returns:
+        list: Row indices of the glyphs whose width falls in [edges[k], edges[k + 1]).
+    """
+    rows = np.flatnonzero(table['valid'])
+    bucket = np.digitize(table['width'][rows], edges) - 1
+    return [rows[bucket == k] for k in range(len(edges) - 1)]
@@ -0,0 +1,166 @@
+import numpy as np
+
+from digit_bank import BAR_CLASS
+from fraction_batch import CHUNK_SIZE, draw_glyph_ids, render_glyph_ids
+from fraction_compositor import BAR_WIDTH_FACTOR
+from fraction_layout import glyph_classes
+
+# Most glyphs of an augmented fraction, digits and bars included
+MAX_GLYPHS = 16
+
+# Augmentation parameters of every sample. 'jitter' is in placement order (top to bottom,
+# left to right, the bar included), 'ids' in draw_glyph_ids order (the digits, then the bars)
+# and 'bar_thickness' has one entry per bar, from top to bottom; unused trailing entries
+# are 0, 0 and -1.
+AUGMENT_DTYPE = np.dtype([('space', '<i4'), ('bar_thickness', '<i4', (MAX_GLYPHS,)), ('bar_width_factor', '<f8'),
+                          ('jitter', '<i4', (MAX_GLYPHS,)), ('scale', '<f8'), ('rotation', '<f8'),
+                          ('ids', '<i8', (MAX_GLYPHS,))])
+
+# A moderate setting of every augmentation, e.g. render_augmented_batch(bank, '4/92', n, rng, **DEFAULT_AUGMENT)
+DEFAULT_AUGMENT = {'space': (0, 3), 'jitter': 2, 'scale': (0.9, 1.1), 'rotation': 5.0, 'bar_thickness': (1, 4),
+                   'bar_width_factor': (1.2, 1.6)}
+
+
+def draw_augment_params(n, rng, space=None, jitter=0, scale=None, rotation=0.0, bar_thickness=None,
+                        bar_width_factor=None, space_btw_ab=1):
+    """
+    Draw the augmentation parameters of n samples.
+
+    Every augmentation left at its default is disabled and recorded at its neutral value.
+
+    Args:
+        n (int): Number of samples.
+        rng (np.random.Generator): Random generator.
+        space (tuple): Inclusive (low, high) space between the two digits of a line.
+        jitter (int): Largest vertical offset of a glyph, in pixels.
+        scale (tuple): (low, high) zoom factor of the whole fraction.
+        rotation (float): Largest rotation of the whole fraction, in degrees.
+        bar_thickness (tuple): Inclusive (low, high) number of rows of the fraction bars.
+        bar_width_factor (tuple): (low, high) width of a two-digit fraction relative to its widest line.
+        space_btw_ab (int): Space used when space is None.
+
+    Returns:
+        np.array: Structured array of dtype AUGMENT_DTYPE; ids and the bar_thickness of
+        every bar are filled in by render_augmented_batch once the glyphs are drawn (all
+        the bars of a sample share a drawn bar_thickness).
+    """
+    params = np.zeros(n, dtype=AUGMENT_DTYPE)
+    params['space'] = space_btw_ab if space is None else rng.integers(space[0], space[1] + 1, size=n)
+    if bar_thickness is not None:
+        params['bar_thickness'] = rng.integers(bar_thickness[0], bar_thickness[1] + 1, size=n)[:, None]
+    if bar_width_factor is None:
+        params['bar_width_factor'] = BAR_WIDTH_FACTOR
+    else:
+        params['bar_width_factor'] = rng.uniform(bar_width_factor[0], bar_width_factor[1], size=n)
+    if jitter:
+        params['jitter'] = rng.integers(-jitter, jitter + 1, size=(n, MAX_GLYPHS))
+    params['scale'] = 1.0 if scale is None else rng.uniform(scale[0], scale[1], size=n)
+    if rotation:
+        params['rotation'] = rng.uniform(-rotation, rotation, size=n)
+    params['ids'] = -1
+    return params
+
+
+def affine_batch(images, shapes, scale, rotation):
+    """
+    Scale and rotate every image of a padded batch about its centre, with bilinear resampling.
+
+    All images are resampled at once with vectorized indexing; each keeps its valid
+    shape, content moved outside of it is cut off and the padding stays zero. An
+    image with scale 1 and rotation 0 is returned unchanged.
+
+    Args:
+        images (np.array): Padded (n, H, W) uint8 batch, zero outside the valid shapes (as render_batch gives).
+        shapes (np.array): Valid (rows, cols) of each image.
+        scale (np.array): Zoom factor of each image.
+        rotation (np.array): Counter-clockwise rotation of each image, in degrees.
+
+    Returns:
+        np.array: New (n, H, W) uint8 batch.
+    """
+    scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), len(images))
+    rotation = np.broadcast_to(np.asarray(rotation, dtype=np.float64), len(images))
+    if ((scale == 1.0) & (rotation == 0.0)).all():
+        return images.copy()
+
+    # A border of two zero pixels lets out-of-range source positions be clamped onto zeros
+    num_rows, num_cols = images.shape[1:]
+    padded = np.pad(images, ((0, 0), (2, 2), (2, 2)))
+    stride = num_cols + 4
+    flat = padded.reshape(-1)
+    out = np.zeros_like(images)
+    Y = np.arange(num_rows, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    X = np.arange(num_cols, dtype=np.float32)[np.newaxis, np.newaxis, :]
+    for start in range(0, len(images), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        rows = shapes[chunk, 0][:, None, None]
+        cols = shapes[chunk, 1][:, None, None]
+        cy = ((rows - 1) / 2.0).astype(np.float32)
+        cx = ((cols - 1) / 2.0).astype(np.float32)
+        theta = np.deg2rad(rotation[chunk])[:, None, None]
+        cos = (np.cos(theta) / scale[chunk][:, None, None]).astype(np.float32)
+        sin = (np.sin(theta) / scale[chunk][:, None, None]).astype(np.float32)
+
+        # Position in the source image of every output pixel (inverse mapping)
+        sx = cos * (X - cx) - sin * (Y - cy) + cx
+        sy = sin * (X - cx) + cos * (Y - cy) + cy
+        x0 = np.floor(sx)
+        y0 = np.floor(sy)
+        fx = sx - x0
+        fy = sy - y0
+
+        # The padding of every image is zero, so only the batch bounds need clamping
+        base = np.arange(start, start + len(rows), dtype=np.int64)[:, None, None] * ((num_rows + 4) * stride)
+        src = (base + (np.clip(y0, -2, num_rows).astype(np.int64) + 2) * stride
+               + np.clip(x0, -2, num_cols).astype(np.int64) + 2)
+        top = flat[src] * (1 - fx) + flat[src + 1] * fx
+        bottom = flat[src + stride] * (1 - fx) + flat[src + stride + 1] * fx
+        pixels = top * (1 - fy) + bottom * fy
+
+        valid = (Y < rows) & (X < cols)
+        np.clip(pixels, 0, 255, out=pixels)
+        out[chunk] = np.where(valid, np.rint(pixels), 0).astype(np.uint8)
+    return out
+
+
+def render_augmented_batch(bank, spec, n, rng=None, space_btw_ab=1, out_shape=None, blend_max=False, **augment):
+    """
+    Render n random fractions of one spec with random spacing, jitter, bar and affine augmentations.
+
+    The parameters are drawn first (see draw_augment_params), then the glyphs, so a
+    batch is fully determined by the state of rng. Spacing, bar thickness and bar width
+    are applied by the layout, the vertical jitter by the placements, and scaling and
+    rotation by affine_batch over the rendered batch.
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        spec (str): Fraction spec, e.g. '4/92'.
+        n (int): Number of fractions.
+        rng (np.random.Generator): Random generator (a fresh unseeded one by default).
+        space_btw_ab (int): Space between the two digits of a line when it is not augmented.
+        out_shape (tuple): (H, W) of the output; defaults to the largest fraction of the batch.
+        blend_max (bool): Max-blend overlapping glyphs instead of overwriting them.
+        **augment: Ranges passed on to draw_augment_params, e.g. DEFAULT_AUGMENT.
+
+    Returns:
+        tuple: (images, shapes, params) as render_batch, plus the AUGMENT_DTYPE parameters of every sample.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    classes = glyph_classes(spec)
+    if len(classes) > MAX_GLYPHS:
+        raise ValueError('{!r} has more than {} glyphs'.format(spec, MAX_GLYPHS))
+    num_bars = classes.count(BAR_CLASS)
+    params = draw_augment_params(n, rng, space_btw_ab=space_btw_ab, **augment)
+    bar_thickness = params['bar_thickness'][:, 0] if augment.get('bar_thickness') is not None else None
+    ids = draw_glyph_ids(bank, spec, n, rng, params['space'], bar_thickness=bar_thickness,
+                         bar_width_factor=params['bar_width_factor'])
+    params['ids'][:, :ids.shape[1]] = ids
+    # Record the thickness of every bar: the drawn one, or the width of each upright "1" glyph
+    if bar_thickness is None:
+        params['bar_thickness'][:, :num_bars] = bank.widths[ids[:, len(classes) - num_bars:]]
+    params['bar_thickness'][:, num_bars:] = 0
+
+    images, shapes = render_glyph_ids(bank, spec, ids, params['space'], out_shape, blend_max, bar_thickness,
+                                      params['bar_width_factor'], params['jitter'])
+    return affine_batch(images, shapes, params['scale'], params['rotation']), shapes, params
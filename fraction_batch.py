@@ -0,0 +1,363 @@
+import numpy as np
+
+import profiling
+
+from digit_bank import BAR_CLASS
+from fraction_compositor import (BAR_WIDTH_FACTOR, layout_a_over_ab, layout_a_over_b, layout_ab_over_ab,
+                                 width_a_over_ab, width_ab_over_ab)
+from fraction_layout import glyph_classes, layout_template, script_family
+
+# Number of samples blitted at once; bounds the size of the temporary index arrays
+CHUNK_SIZE = 1024
+
+
+def parse_spec(spec):
+    """
+    Split a fraction spec such as '4/9', '4/92', '123/4567', '3 1/4' or '(1/2)/(3/4)' into its digits.
+
+    Args:
+        spec (str): Fraction spec (see fraction_layout.parse_layout).
+
+    Returns:
+        tuple: (family, digits) where family is 'a_over_b', 'a_over_ab', 'ab_over_ab' or
+        'layout' for any other shape, and digits lists the digits in reading order.
+    """
+    # The script families are laid out by the vectorized rules of the scripts, every other
+    # spec goes through the templates of fraction_layout
+    family = script_family(spec)
+    return family or 'layout', [c for c in glyph_classes(spec) if c != BAR_CLASS]
+
+
+def _glyph_shapes(bank, ids):
+    return bank.heights[ids], bank.widths[ids]
+
+
+def _per_sample(value, index):
+    """Select some samples of a per-sample array; scalars apply to every sample."""
+    return value if np.ndim(value) == 0 else np.asarray(value)[index]
+
+
+def _prepare_bars(bank, bar_ids, col_num, thickness=None):
+    """
+    Fetch each distinct (bar, length) pair once from the bank's bar pool and pack the
+    horizontal bars into a buffer.
+
+    Args:
+        thickness (np.array): Optional number of rows of each bar (default: its own width).
+
+    Returns:
+        tuple: (buffer, offsets, heights, widths) of one horizontal bar per sample.
+    """
+    if thickness is None:
+        pairs, inverse = np.unique(np.stack([bar_ids, col_num], axis=1), axis=0, return_inverse=True)
+        bars = [bank.bar_pool.stretched(int(bar_id), int(length)) for bar_id, length in pairs]
+    else:
+        keys = np.stack(np.broadcast_arrays(bar_ids, col_num, thickness), axis=1)
+        pairs, inverse = np.unique(keys, axis=0, return_inverse=True)
+        bars = [bank.bar_pool.stretched(int(bar_id), int(length), int(rows)) for bar_id, length, rows in pairs]
+    heights = np.array([b.shape[0] for b in bars], dtype=np.int64)
+    widths = np.array([b.shape[1] for b in bars], dtype=np.int64)
+    offsets = np.zeros(len(bars), dtype=np.int64)
+    np.cumsum((heights * widths)[:-1], out=offsets[1:])
+    buffer = np.concatenate([b.ravel() for b in bars])
+    inverse = inverse.ravel()
+    return buffer, offsets[inverse], heights[inverse], widths[inverse]
+
+
+def _layout_templates(bank, spec, ids, space_btw_ab, with_pixels=True, bar_thickness=None,
+                      bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Lay out a batch of fractions of any spec with fraction_layout.layout_template.
+
+    One template is computed (or fetched from its cache) per distinct combination of glyph
+    shapes, space and bar width in the batch, then scattered back to the samples.
+    """
+    n, num_glyphs = ids.shape
+    num_digits = len(parse_spec(spec)[1])
+    heights, widths = bank.heights[ids], bank.widths[ids]
+    if bar_thickness is None:
+        thickness = widths[:, num_digits:]
+    else:
+        thickness = np.broadcast_to(np.reshape(bar_thickness, (-1, 1)), (n, num_glyphs - num_digits))
+    keys = np.column_stack([heights, widths[:, :num_digits], thickness, np.broadcast_to(space_btw_ab, n),
+                            np.broadcast_to(bar_width_factor, n)]).astype(np.float64)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    templates = []
+    for key in unique:
+        digit_shapes = tuple((int(h), int(w)) for h, w in zip(key[:num_digits], key[num_glyphs:num_glyphs + num_digits]))
+        bar_shapes = tuple((int(h), int(t)) for h, t in zip(key[num_digits:num_glyphs],
+                                                             key[num_glyphs + num_digits:2 * num_glyphs]))
+        templates.append(layout_template(spec, digit_shapes, bar_shapes, int(key[-2]), float(key[-1])))
+
+    # The paint order only depends on the spec, so placement k is the same glyph in every template
+    shape = tuple(np.array([t[0][axis] for t in templates], dtype=np.int64)[inverse] for axis in (0, 1))
+    order = [glyph for glyph, _, _ in templates[0][1]] if templates else []
+    rows = np.array([[row for _, row, _ in t[1]] for t in templates], dtype=np.int64).reshape(len(templates), -1)
+    cols = np.array([[col for _, _, col in t[1]] for t in templates], dtype=np.int64).reshape(len(templates), -1)
+    bar_lengths = np.array([t[2] for t in templates], dtype=np.int64).reshape(len(templates), -1)[inverse]
+
+    sources = [(bank.buffer, bank.offsets[ids[:, i]], heights[:, i], widths[:, i], False) for i in range(num_digits)]
+    for j in range(num_glyphs - num_digits):
+        if with_pixels:
+            buffer, offsets, bar_h, bar_w = _prepare_bars(bank, ids[:, num_digits + j], bar_lengths[:, j],
+                                                          None if bar_thickness is None else thickness[:, j])
+        else:
+            buffer, offsets, bar_h, bar_w = None, None, thickness[:, j], bar_lengths[:, j]
+        sources.append((buffer, offsets, bar_h, bar_w, False))
+    placements = [(rows[inverse, k], cols[inverse, k]) for k in range(len(order))]
+    return shape, placements, [sources[glyph] for glyph in order]
+
+
+def _layout(bank, spec, ids, space_btw_ab, with_pixels=True, bar_thickness=None, bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Lay out a batch of fractions from their glyph ids.
+
+    With with_pixels=False only the shapes are computed and the stretched bars are not resized.
+    space_btw_ab, bar_thickness and bar_width_factor may be scalars or per-sample arrays.
+
+    Returns:
+        tuple: ((row_num, col_num), placements, sources) where each source is
+        (buffer, offsets, heights, widths, transposed) for the glyph of the matching placement.
+    """
+    family = parse_spec(spec)[0]
+    if family == 'layout':
+        return _layout_templates(bank, spec, ids, space_btw_ab, with_pixels, bar_thickness, bar_width_factor)
+
+    digits = [_glyph_shapes(bank, ids[:, i]) for i in range(ids.shape[1] - 1)]
+    bar_ids = ids[:, -1]
+    sources = [(bank.buffer, bank.offsets[ids[:, i]], h, w, False) for i, (h, w) in enumerate(digits)]
+
+    if family == 'a_over_b' and bar_thickness is None:
+        # The bar is used as is, read transposed straight from the bank
+        bar_h, bar_w = _glyph_shapes(bank, bar_ids)
+        bar = (bank.buffer, bank.offsets[bar_ids], bar_w, bar_h, True)
+        shape, placements = layout_a_over_b(digits[0], digits[1], (bar_w, bar_h))
+        return shape, placements, [sources[0], bar, sources[1]]
+
+    if family == 'a_over_b':
+        # A thicker or thinner bar keeps its own length
+        col_num = bank.heights[bar_ids]
+    elif family == 'a_over_ab':
+        col_num = width_a_over_ab(digits[0], digits[1], digits[2], bar_width_factor)
+    else:
+        col_num = width_ab_over_ab(digits[0], digits[1], digits[2], digits[3], bar_width_factor)
+    if with_pixels:
+        buffer, offsets, bar_h, bar_w = _prepare_bars(bank, bar_ids, col_num, bar_thickness)
+    else:
+        # A bar stretched to col_num keeps the width of the upright "1" as its height
+        bar_h = bank.widths[bar_ids] if bar_thickness is None else np.broadcast_to(bar_thickness, len(ids))
+        buffer, offsets, bar_w = None, None, col_num
+    bar = (buffer, offsets, bar_h, bar_w, False)
+
+    if family == 'a_over_b':
+        shape, placements = layout_a_over_b(digits[0], digits[1], (bar_h, bar_w))
+        return shape, placements, [sources[0], bar, sources[1]]
+    if family == 'a_over_ab':
+        shape, placements = layout_a_over_ab(digits[0], digits[1], digits[2], (bar_h, bar_w), space_btw_ab,
+                                             bar_width_factor)
+        return shape, placements, [sources[0], bar, sources[1], sources[2]]
+    shape, placements = layout_ab_over_ab(digits[0], digits[1], digits[2], digits[3], (bar_h, bar_w), space_btw_ab,
+                                          bar_width_factor)
+    return shape, placements, [sources[0], sources[1], bar, sources[2], sources[3]]
+
+
+def _fits(shape, placements, sources, wrap=False):
+    """
+    Return the samples whose glyphs all fit inside the fraction (compose() would not raise).
+
+    With wrap, a glyph may start left of column 0 and wrap around to the end of the row
+    like in the scripts; the other layouts must keep every glyph inside.
+    """
+    row_num, col_num = shape
+    ok = np.ones(len(row_num), dtype=bool)
+    for (row, col), (buffer, offsets, heights, widths, transposed) in zip(placements, sources):
+        ok &= (row >= 0) & (row + heights <= row_num)
+        ok &= (col >= (-col_num if wrap else 0)) & (col + widths <= col_num) & (widths <= col_num)
+    return ok
+
+
+def fitting_mask(bank, spec, ids, space_btw_ab=1, bar_thickness=None, bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Return which glyph combinations of a spec fit inside their fraction (the others are redrawn).
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        spec (str): Fraction spec, e.g. '4/92'.
+        ids (np.array): Glyph ids in draw_glyph_ids order.
+        space_btw_ab (int or np.array): Space between the two digits of a two-digit line, or one per sample.
+        bar_thickness (np.array): Optional number of rows of the fraction bar of each sample.
+        bar_width_factor (float or np.array): Width of a two-digit fraction relative to its widest line.
+
+    Returns:
+        np.array: bool array with one entry per row of ids.
+    """
+    return _fits(*_layout(bank, spec, np.asarray(ids, dtype=np.int64), space_btw_ab, False, bar_thickness,
+                          bar_width_factor), wrap=parse_spec(spec)[0] != 'layout')
+
+
+def draw_glyph_ids(bank, spec, n, rng, space_btw_ab=1, max_attempts=100, bar_thickness=None,
+                   bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Draw the glyphs of n fractions, redrawing the few combinations that do not fit.
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        spec (str): Fraction spec, e.g. '4/92'.
+        n (int): Number of fractions.
+        rng (np.random.Generator): Random generator.
+        space_btw_ab (int or np.array): Space between the two digits of a two-digit line, or one per sample.
+        max_attempts (int): Give up after this many redraw rounds.
+        bar_thickness (np.array): Optional number of rows of the fraction bar of each sample.
+        bar_width_factor (float or np.array): Width of a two-digit fraction relative to its widest line.
+
+    Returns:
+        np.array: int64 array of shape (n, num_glyphs), columns in fraction_layout.glyph_classes order:
+        the digits, then the fraction bars (a single last column for a/b, a/ab and ab/ab).
+    """
+    classes = glyph_classes(spec)
+    ranges = np.array([bank.class_range(c) for c in classes], dtype=np.int64)
+
+    ids = np.empty((n, len(classes)), dtype=np.int64)
+    todo = np.arange(n)
+    for attempt in range(max_attempts):
+        if len(todo) == 0:
+            return ids
+        draw = ranges[:, 0] + rng.integers(0, ranges[:, 1] - ranges[:, 0], size=(len(todo), len(classes)))
+        ok = fitting_mask(bank, spec, draw, _per_sample(space_btw_ab, todo),
+                          None if bar_thickness is None else _per_sample(bar_thickness, todo),
+                          _per_sample(bar_width_factor, todo))
+        ids[todo[ok]] = draw[ok]
+        todo = todo[~ok]
+    if len(todo):
+        raise RuntimeError('could not draw {} fitting glyph combinations for {!r}'.format(len(todo), spec))
+    return ids
+
+
+def _blit(images, start, shape, row, col, source, blend_max):
+    """
+    Copy one glyph per sample into images[start:start + len(row)].
+
+    Only the (n, max_height, max_width) window of the glyphs is gathered from the source
+    and scattered to its place, so the cost follows the glyph sizes, not the canvas.
+    """
+    buffer, offsets, heights, widths, transposed = source
+    n = len(row)
+    if n == 0:
+        return
+    num_rows, num_cols = images.shape[1:]
+    r = np.arange(heights.max())
+    c = np.arange(widths.max())
+    inside = (r[np.newaxis, :, np.newaxis] < heights[:, None, None]) & (c < widths[:, None, None])
+    if transposed:
+        src = (offsets[:, None] + r)[:, :, None] + c * heights[:, None, None]
+    else:
+        src = (offsets[:, None] + r * widths[:, None])[:, :, None] + c
+
+    # Flat canvas index of the first column of every window row
+    row_starts = (((start + np.arange(n)) * num_rows + row)[:, None] + r) * num_cols
+    if (col >= 0).all():
+        dst = (row_starts + col[:, None])[:, :, None] + c
+    else:
+        # Negative columns wrap around the fraction like numpy indexing in the scripts
+        dst = row_starts[:, :, None] + ((col[:, None] + c) % shape[1][:, None])[:, None, :]
+
+    dst, src = dst[inside], src[inside]
+    flat = images.reshape(-1)
+    if blend_max:
+        flat[dst] = np.maximum(flat[dst], buffer[src])
+    else:
+        flat[dst] = buffer[src]
+
+
+def render_glyph_ids(bank, spec, ids, space_btw_ab=1, out_shape=None, blend_max=False, bar_thickness=None,
+                     bar_width_factor=BAR_WIDTH_FACTOR, jitter=None):
+    """
+    Render fractions from already drawn glyph ids into one padded array.
+
+    Sample i holds the same pixels as the generate_fraction_array_* function for
+    the same glyphs, in images[i, :shapes[i, 0], :shapes[i, 1]]; the rest is zero.
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        spec (str): Fraction spec, e.g. '4/92'.
+        ids (np.array): Glyph ids as returned by draw_glyph_ids.
+        space_btw_ab (int or np.array): Space between the two digits of a two-digit line, or one per sample.
+        out_shape (tuple): (H, W) of the output; defaults to the largest fraction of the batch.
+        blend_max (bool): Max-blend overlapping glyphs instead of overwriting them.
+        bar_thickness (np.array): Optional number of rows of the fraction bar of each sample.
+        bar_width_factor (float or np.array): Width of a two-digit fraction relative to its widest line.
+        jitter (np.array): Optional (n, num_glyphs) vertical offsets of the glyphs, in placement
+            order; each fraction grows by its largest offset above and below.
+
+    Returns:
+        tuple: (images, shapes) with images of shape (n, H, W) uint8 and shapes of shape (n, 2).
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    shape, placements, sources = _layout(bank, spec, ids, space_btw_ab, True, bar_thickness, bar_width_factor)
+    if jitter is not None:
+        jitter = np.asarray(jitter, dtype=np.int64)[:, :len(placements)]
+        if jitter.shape[1] < len(placements):
+            jitter = np.pad(jitter, ((0, 0), (0, len(placements) - jitter.shape[1])))
+        margin = np.abs(jitter).max(axis=1) if len(placements) else 0
+        shape = (shape[0] + 2 * margin, shape[1])
+        placements = [(row + margin + jitter[:, k], col) for k, (row, col) in enumerate(placements)]
+    shapes = np.stack([shape[0], shape[1]], axis=1).astype(np.int64)
+
+    if out_shape is None:
+        out_shape = tuple(shapes.max(axis=0)) if len(shapes) else (0, 0)
+    elif (shapes > np.asarray(out_shape)).any():
+        raise ValueError('fractions up to {} do not fit in out_shape {}'.format(tuple(shapes.max(axis=0)), out_shape))
+
+    images = np.zeros((len(ids),) + tuple(int(s) for s in out_shape), dtype=np.uint8)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        chunk_shape = (shape[0][chunk], shape[1][chunk])
+        for (row, col), source in zip(placements, sources):
+            buffer, offsets, heights, widths, transposed = source
+            chunk_source = (buffer, offsets[chunk], heights[chunk], widths[chunk], transposed)
+            _blit(images, start, chunk_shape, np.broadcast_to(row, len(ids))[chunk],
+                  np.broadcast_to(col, len(ids))[chunk], chunk_source, blend_max)
+    return images, shapes
+
+
+def render_batch(bank, spec, n, rng=None, space_btw_ab=1, out_shape=None, blend_max=False):
+    """
+    Render n random fractions of one spec into a preallocated, padded uint8 array.
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        spec (str): Fraction spec, e.g. '4/9', '4/92', '41/92', '123/4567', '3 1/4' or '(1/2)/(3/4)'.
+        n (int): Number of fractions.
+        rng (np.random.Generator): Random generator (a fresh unseeded one by default).
+        space_btw_ab (int): Space between the two digits of a two-digit line.
+        out_shape (tuple): (H, W) of the output; defaults to the largest fraction of the batch.
+        blend_max (bool): Max-blend overlapping glyphs instead of overwriting them.
+
+    Returns:
+        tuple: (images, shapes) with images of shape (n, H, W) uint8 and the valid
+        (rows, cols) of each sample in shapes; see valid_mask.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    with profiling.stage('draw_glyph_ids'):
+        ids = draw_glyph_ids(bank, spec, n, rng, space_btw_ab)
+    with profiling.stage('render_glyph_ids'):
+        return render_glyph_ids(bank, spec, ids, space_btw_ab, out_shape, blend_max)
+
+
+def valid_mask(shapes, out_shape):
+    """
+    Return the boolean mask of the valid pixels of each sample of a padded batch.
+
+    Args:
+        shapes (np.array): (n, 2) valid shapes returned by render_batch.
+        out_shape (tuple): (H, W) of the padded batch.
+
+    Returns:
+        np.array: bool array of shape (n, H, W).
+    """
+    rows = np.arange(out_shape[0])[np.newaxis, :, np.newaxis] < shapes[:, 0, None, None]
+    cols = np.arange(out_shape[1])[np.newaxis, np.newaxis, :] < shapes[:, 1, None, None]
+    return rows & cols
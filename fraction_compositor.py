@@ -0,0 +1,260 @@
+from PIL import Image
+import numpy as np
+
+# Factor by which the fraction bar of the complex fractions is wider than its widest line
+BAR_WIDTH_FACTOR = 1.4
+
+
+def _trunc(x):
+    """Truncate toward zero like int(), for Python numbers and numpy arrays alike."""
+    return np.trunc(x).astype(np.int64)
+
+
+def resize_bar(img_bar, col_num):
+    """
+    Stretch an upright "1" to the given length and lay it down as a horizontal fraction bar.
+
+    Args:
+        img_bar (np.array): Image of the upright fraction bar, shape (rows, width).
+        col_num (int): Length of the bar in pixels.
+
+    Returns:
+        np.array: Horizontal bar of shape (width, col_num).
+    """
+    img = Image.fromarray(np.ascontiguousarray(img_bar), 'L')
+    width, height = img.size
+    return np.array(img.resize((width, col_num))).T
+
+
+def _stretch_bar(img_bar, col_num):
+    """Resize an upright bar, or ask a cached stretcher for the bar of that length."""
+    if callable(img_bar):
+        return img_bar(col_num)
+    return resize_bar(img_bar, col_num)
+
+
+def layout_a_over_b(nume_shape, deno_shape, bar_shape):
+    """
+    Compute the placements of a fraction "a/b".
+
+    The layout_* functions accept ints or numpy arrays for every dimension, so the
+    same code lays out a single fraction or a whole batch of them.
+
+    Args:
+        nume_shape (tuple): Shape of the numerator image.
+        deno_shape (tuple): Shape of the denominator image.
+        bar_shape (tuple): Shape of the horizontal (transposed) fraction bar.
+
+    Returns:
+        tuple: ((row_num, col_num), placements) with one (row, column) offset for the
+        numerator, the bar and the denominator, in that order.
+    """
+    row_num = nume_shape[0] + deno_shape[0] + bar_shape[0]
+    col_num = np.maximum(np.maximum(nume_shape[1], deno_shape[1]), bar_shape[1])
+    placements = [
+        (0, _trunc((col_num - nume_shape[1]) / 2)),
+        (nume_shape[0], _trunc((col_num - bar_shape[1]) / 2)),
+        (nume_shape[0] + bar_shape[0], _trunc((col_num - deno_shape[1]) / 2)),
+    ]
+    return (row_num, col_num), placements
+
+
+def width_a_over_ab(nume_a_shape, deno_a_shape, deno_b_shape, bar_width_factor=BAR_WIDTH_FACTOR):
+    """Return the width (and bar length) of a fraction "a/ab"."""
+    return _trunc(np.maximum(nume_a_shape[1], deno_a_shape[1] + deno_b_shape[1]) * bar_width_factor)
+
+
+def layout_a_over_ab(nume_a_shape, deno_a_shape, deno_b_shape, bar_shape, space_btw_ab,
+                     bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Compute the placements of a fraction "a/ab".
+
+    Args:
+        nume_a_shape (tuple): Shape of the numerator "a".
+        deno_a_shape (tuple): Shape of the first part of the denominator "a".
+        deno_b_shape (tuple): Shape of the second part of the denominator "b".
+        bar_shape (tuple): Shape of the horizontal bar, already resized to width_a_over_ab.
+        space_btw_ab (int): Space between the "a" and "b" parts of the denominator in pixels.
+        bar_width_factor (float): Width of the fraction relative to its widest line.
+
+    Returns:
+        tuple: ((row_num, col_num), placements) for the numerator, the bar and the two
+        denominator digits, in that order.
+    """
+    col_num = width_a_over_ab(nume_a_shape, deno_a_shape, deno_b_shape, bar_width_factor)
+    row_num = nume_a_shape[0] + deno_a_shape[0] + bar_shape[0]
+    row_deno = nume_a_shape[0] + bar_shape[0]
+    placements = [
+        (0, _trunc((col_num - nume_a_shape[1]) / 2)),
+        (nume_a_shape[0], _trunc((col_num - bar_shape[1]) / 2)),
+        (row_deno, _trunc(col_num / 2 - deno_a_shape[1]) - space_btw_ab),
+        (row_deno, _trunc(col_num / 2) + space_btw_ab),
+    ]
+    return (row_num, col_num), placements
+
+
+def width_ab_over_ab(nume_a_shape, nume_b_shape, deno_a_shape, deno_b_shape, bar_width_factor=BAR_WIDTH_FACTOR):
+    """Return the width (and bar length) of a fraction "ab/ab"."""
+    return _trunc(np.maximum(nume_a_shape[1] + nume_b_shape[1], deno_a_shape[1] + deno_b_shape[1]) * bar_width_factor)
+
+
+def layout_ab_over_ab(nume_a_shape, nume_b_shape, deno_a_shape, deno_b_shape, bar_shape, space_btw_ab,
+                      bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Compute the placements of a fraction "ab/ab".
+
+    Args:
+        nume_a_shape (tuple): Shape of numerator's first digit.
+        nume_b_shape (tuple): Shape of numerator's second digit.
+        deno_a_shape (tuple): Shape of denominator's first digit.
+        deno_b_shape (tuple): Shape of denominator's second digit.
+        bar_shape (tuple): Shape of the horizontal bar, already resized to width_ab_over_ab.
+        space_btw_ab (int): Space between the two digits of the numerator and of the denominator.
+        bar_width_factor (float): Width of the fraction relative to its widest line.
+
+    Returns:
+        tuple: ((row_num, col_num), placements) for the two numerator digits, the bar
+        and the two denominator digits, in that order.
+    """
+    col_num = width_ab_over_ab(nume_a_shape, nume_b_shape, deno_a_shape, deno_b_shape, bar_width_factor)
+    row_num = nume_a_shape[0] + deno_a_shape[0] + bar_shape[0]
+    row_deno = nume_a_shape[0] + bar_shape[0]
+    placements = [
+        (0, _trunc(col_num / 2 - nume_a_shape[1]) - space_btw_ab),
+        (0, _trunc(col_num / 2) + space_btw_ab),
+        (nume_a_shape[0], _trunc((col_num - bar_shape[1]) / 2)),
+        (row_deno, _trunc(col_num / 2 - deno_a_shape[1]) - space_btw_ab),
+        (row_deno, _trunc(col_num / 2) + space_btw_ab),
+    ]
+    return (row_num, col_num), placements
+
+
+def paste(fraction_array, glyph, row, col, blend_max=False):
+    """
+    Copy a glyph into a fraction array at the given offset with slice assignment.
+
+    Matches the per-pixel loops of the original scripts exactly: a negative column
+    wraps around to the end of the row (numpy indexing), and a glyph reaching past
+    the bottom or right edge raises IndexError.
+
+    Args:
+        fraction_array (np.array): Destination array, modified in place.
+        glyph (np.array): 2D uint8 glyph.
+        row (int): Row of the top-left corner of the glyph.
+        col (int): Column of the top-left corner of the glyph.
+        blend_max (bool): Keep the brighter pixel where glyphs overlap instead of overwriting.
+    """
+    row_num, col_num = fraction_array.shape
+    height, width = glyph.shape
+    row, col = int(row), int(col)
+    if height == 0 or width == 0:
+        return
+    if row < 0 or row + height > row_num or col < -col_num or col + width > col_num:
+        raise IndexError('glyph of shape {} does not fit at ({}, {}) in {}'.format(
+            glyph.shape, row, col, fraction_array.shape))
+
+    if col >= 0:
+        # Common case: the glyph lies inside the array
+        pieces = [(col, glyph)]
+    elif width <= col_num:
+        # Columns left of 0 wrap around to the end of the row, and are written first
+        pieces = [(col_num + col, glyph[:, :min(-col, width)]), (0, glyph[:, -col:])]
+    else:
+        # Wider than the array: fall back to fancy indexing (later columns win)
+        cols = np.arange(col, col + width) % col_num
+        if blend_max:
+            for idx_c, c in enumerate(cols):
+                np.maximum(fraction_array[row:row + height, c], glyph[:, idx_c], out=fraction_array[row:row + height, c])
+        else:
+            fraction_array[row:row + height, cols] = glyph
+        return
+
+    for start, piece in pieces:
+        if piece.shape[1] == 0:
+            continue
+        target = fraction_array[row:row + height, start:start + piece.shape[1]]
+        if blend_max:
+            np.maximum(target, piece, out=target)
+        else:
+            target[...] = piece
+
+
+def compose(layout, glyphs, blend_max=False):
+    """
+    Blit glyphs into a new fraction array following a layout.
+
+    Args:
+        layout (tuple): ((row_num, col_num), placements) as returned by the layout_* functions.
+        glyphs (list): One 2D uint8 glyph per placement, in the same order.
+        blend_max (bool): Max-blend overlapping glyphs instead of overwriting them.
+
+    Returns:
+        np.array: uint8 array of shape (row_num, col_num).
+    """
+    shape, placements = layout
+    fraction_array = np.zeros((int(shape[0]), int(shape[1])), dtype=np.uint8)
+    for glyph, (row, col) in zip(glyphs, placements):
+        paste(fraction_array, glyph, row, col, blend_max)
+    return fraction_array
+
+
+def compose_a_over_b(img_nume, img_deno, img_bar, blend_max=False):
+    """
+    Compose a fraction "a/b" from its glyphs.
+
+    Args:
+        img_nume (np.array): Image of the numerator.
+        img_deno (np.array): Image of the denominator.
+        img_bar (np.array): Image of the upright fraction bar (transposed here).
+        blend_max (bool): Max-blend overlapping glyphs.
+
+    Returns:
+        np.array: Numpy array representing the fraction "a/b".
+    """
+    img_bar = img_bar.T
+    layout = layout_a_over_b(img_nume.shape, img_deno.shape, img_bar.shape)
+    return compose(layout, [img_nume, img_bar, img_deno], blend_max)
+
+
+def compose_a_over_ab(img_nume_a, img_deno_a, img_deno_b, img_bar, space_btw_ab, blend_max=False):
+    """
+    Compose a fraction "a/ab" from its glyphs.
+
+    Args:
+        img_nume_a (np.array): Image of the numerator "a".
+        img_deno_a (np.array): Image of the first part of the denominator "a".
+        img_deno_b (np.array): Image of the second part of the denominator "b".
+        img_bar (np.array or callable): Image of the upright fraction bar (resized and transposed
+            here), or a callable returning the horizontal bar for a length (see BarPool.stretcher).
+        space_btw_ab (int): Space between the "a" and "b" parts of the denominator in pixels.
+        blend_max (bool): Max-blend overlapping glyphs.
+
+    Returns:
+        np.array: Numpy array representing the fraction "a/ab".
+    """
+    img_bar = _stretch_bar(img_bar, int(width_a_over_ab(img_nume_a.shape, img_deno_a.shape, img_deno_b.shape)))
+    layout = layout_a_over_ab(img_nume_a.shape, img_deno_a.shape, img_deno_b.shape, img_bar.shape, space_btw_ab)
+    return compose(layout, [img_nume_a, img_bar, img_deno_a, img_deno_b], blend_max)
+
+
+def compose_ab_over_ab(img_nume_a, img_nume_b, img_deno_a, img_deno_b, img_bar, space_btw_ab, blend_max=False):
+    """
+    Compose a fraction "ab/ab" from its glyphs.
+
+    Args:
+        img_nume_a (np.array): Image of numerator's first digit.
+        img_nume_b (np.array): Image of numerator's second digit.
+        img_deno_a (np.array): Image of denominator's first digit.
+        img_deno_b (np.array): Image of denominator's second digit.
+        img_bar (np.array or callable): Image of the upright fraction bar (resized and transposed
+            here), or a callable returning the horizontal bar for a length (see BarPool.stretcher).
+        space_btw_ab (int): Space between the two digits of the numerator and of the denominator.
+        blend_max (bool): Max-blend overlapping glyphs.
+
+    Returns:
+        np.array: Numpy array representing the fraction "ab/ab".
+    """
+    img_bar = _stretch_bar(img_bar, int(width_ab_over_ab(img_nume_a.shape, img_nume_b.shape, img_deno_a.shape, img_deno_b.shape)))
+    layout = layout_ab_over_ab(img_nume_a.shape, img_nume_b.shape, img_deno_a.shape, img_deno_b.shape,
+                               img_bar.shape, space_btw_ab)
+    return compose(layout, [img_nume_a, img_nume_b, img_bar, img_deno_a, img_deno_b], blend_max)
@@ -0,0 +1,382 @@
+import argparse
+import collections
+import csv
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+import numpy as np
+
+from fraction_layout import spec_file_prefix
+from fraction_shards import ShardReader
+from post_processing import IMAGE_EXTENSIONS
+import profiling
+
+# Images per model call of run_inference
+BATCH_SIZE = 1024
+
+# Batches decoded ahead of the model by run_inference
+PREFETCH = 4
+
+# Largest micro-batch of MicroBatcher, and how long it waits for more requests once one arrived (seconds)
+MAX_BATCH_SIZE = 64
+MAX_DELAY = 0.002
+
+
+def load_model(path_model):
+    """
+    Load a model saved from the notebook (model.save(...)).
+
+    TensorFlow is only imported here, so the rest of the module works without it.
+
+    Args:
+        path_model (str): Saved model ('.keras', '.h5' or a SavedModel directory).
+    """
+    import tensorflow as tf
+    return tf.keras.models.load_model(path_model)
+
+
+def normalize_images(images, image_size=(28, 28)):
+    """
+    Convert images to the input of the notebook models: grayscale, resized and scaled to [0, 1].
+
+    Args:
+        images (list): PIL images or 2D uint8 arrays of any size.
+        image_size (tuple): (width, height) passed to PIL's resize.
+
+    Returns:
+        np.array: float32 array of shape (n, height, width, 1).
+    """
+    out = np.empty((len(images), image_size[1], image_size[0], 1), dtype=np.float32)
+    for i, image in enumerate(images):
+        img = image if isinstance(image, Image.Image) else Image.fromarray(np.ascontiguousarray(image), 'L')
+        out[i, :, :, 0] = np.asarray(img.convert('L').resize(image_size))
+    out /= 255.0
+    return out
+
+
+class FolderSource:
+    """Every image file of a directory tree, in sorted order, named by its path relative to the root."""
+
+    def __init__(self, path_folder):
+        self.paths = []
+        for root, dirs, files in os.walk(path_folder):
+            dirs.sort()
+            self.paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+        self.names = [os.path.relpath(path, path_folder) for path in self.paths]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def load(self, start, stop, image_size=(28, 28)):
+        """Decode and normalize images [start, stop)."""
+        images = []
+        for path in self.paths[start:stop]:
+            with profiling.stage('decode'), Image.open(path) as img:
+                images.append(img.convert('L'))
+        return normalize_images(images, image_size)
+
+
+class ShardSource:
+    """Every image of a shard directory, named like the JPEGs of the generators ('4_over_92_id_17')."""
+
+    def __init__(self, path_shards):
+        self.reader = ShardReader(path_shards)
+        self.names = ['{}_id_{}'.format(spec_file_prefix(spec), i)
+                      for spec, i in zip(self.reader.index['spec'], self.reader.index['id'])]
+
+    def __len__(self):
+        return len(self.reader)
+
+    def load(self, start, stop, image_size=(28, 28)):
+        """Normalize images [start, stop), read from the memory-mapped shards."""
+        return normalize_images([self.reader[i] for i in range(start, min(stop, len(self.reader)))], image_size)
+
+
+def open_source(path_source):
+    """Return a ShardSource for a directory of shards and a FolderSource for any other directory."""
+    if any(f.endswith('.index.npy') for f in os.listdir(path_source)):
+        return ShardSource(path_source)
+    return FolderSource(path_source)
+
+
+def iter_batches(source, batch_size=BATCH_SIZE, image_size=(28, 28), num_workers=None, prefetch=PREFETCH):
+    """
+    Decode a source batch by batch on a thread pool, keeping up to prefetch batches ready ahead of the consumer.
+
+    Args:
+        source (FolderSource or ShardSource): Images to decode.
+        batch_size (int): Images per batch.
+        image_size (tuple): (width, height) of the model input.
+        num_workers (int): Decoding threads; None uses one per core.
+        prefetch (int): Batches decoded ahead.
+
+    Yields:
+        tuple: (start, images) with images float32 of shape (n, height, width, 1), in order.
+    """
+    starts = iter(range(0, len(source), batch_size))
+    with ThreadPoolExecutor(num_workers or os.cpu_count()) as executor:
+        pending = collections.deque()
+        try:
+            for start in starts:
+                pending.append((start, executor.submit(source.load, start, start + batch_size, image_size)))
+                if len(pending) >= max(prefetch, 1):
+                    break
+            while pending:
+                start, future = pending.popleft()
+                images = future.result()
+                for next_start in starts:
+                    pending.append((next_start, executor.submit(source.load, next_start, next_start + batch_size,
+                                                                image_size)))
+                    break
+                yield start, images
+        finally:
+            # The consumer may stop early; drop the batches decoded ahead
+            for _, future in pending:
+                future.cancel()
+
+
+def _predict(model, images):
+    return np.asarray(model.predict_on_batch(images), dtype=np.float32)
+
+
+def write_predictions(path_output, names, probabilities, class_names=None):
+    """
+    Write all predictions at once: a '.csv' file (name, label, confidence) or a '.npz'
+    archive with the names, labels, confidences and full probabilities.
+
+    Args:
+        path_output (str): Output file.
+        names (list): Name of every image.
+        probabilities (np.array): float32 model outputs of shape (n, num_classes).
+        class_names (list): Optional name of every class, written instead of the class index.
+    """
+    labels = probabilities.argmax(axis=1) if len(probabilities) else np.zeros(0, dtype=np.int64)
+    confidences = probabilities[np.arange(len(labels)), labels] if len(labels) else np.zeros(0, dtype=np.float32)
+    predicted = np.asarray(class_names)[labels] if class_names is not None else labels
+    if path_output.endswith('.csv'):
+        # csv quotes names holding commas, quotes or newlines
+        with open(path_output, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['name', 'label', 'confidence'])
+            writer.writerows([name, label, '{:.6f}'.format(confidence)]
+                             for name, label, confidence in zip(names, predicted, confidences))
+    else:
+        np.savez(path_output, names=np.asarray(names), labels=predicted, confidences=confidences,
+                 probabilities=probabilities)
+
+
+def run_inference(model, path_source, path_output, batch_size=BATCH_SIZE, image_size=(28, 28), num_workers=None,
+                  prefetch=PREFETCH, class_names=None):
+    """
+    Classify every image of a folder or shard directory with a trained model.
+
+    The model is loaded once; decoding and resizing run on a thread pool ahead of the
+    model, which sees large batches. The predictions are kept in memory and written
+    in one go at the end.
+
+    Args:
+        model: Keras model, or the path of a saved one.
+        path_source (str): Directory of image files (searched recursively) or of shards.
+        path_output (str): Predictions file ('.csv' or '.npz', see write_predictions).
+        batch_size (int): Images per model call.
+        image_size (tuple): (width, height) of the model input.
+        num_workers (int): Decoding threads; None uses one per core.
+        prefetch (int): Batches decoded ahead of the model.
+        class_names (list): Optional name of every class, e.g. the specs of a FractionStream.
+
+    Returns:
+        dict: Number of images, elapsed seconds, images per second and seconds spent in the model.
+    """
+    if isinstance(model, str):
+        model = load_model(model)
+    source = open_source(path_source)
+
+    time_start = time.perf_counter()
+    time_model = 0.0
+    probabilities = None
+    for start, images in iter_batches(source, batch_size, image_size, num_workers, prefetch):
+        time_batch = time.perf_counter()
+        with profiling.stage('predict'):
+            batch = _predict(model, images)
+        time_model += time.perf_counter() - time_batch
+        if probabilities is None:
+            probabilities = np.empty((len(source), batch.shape[1]), dtype=np.float32)
+        probabilities[start:start + len(batch)] = batch
+        profiling.count('images', len(batch))
+    if probabilities is None:
+        probabilities = np.zeros((0, 0), dtype=np.float32)
+
+    with profiling.stage('write'):
+        write_predictions(path_output, source.names, probabilities, class_names)
+    elapsed = time.perf_counter() - time_start
+
+    stats = {'num_images': len(source), 'seconds': elapsed, 'images_per_sec': len(source) / elapsed if elapsed else 0.0,
+             'model_seconds': time_model}
+    print('classified {} images in {:.1f}s ({:.0f} images/sec, {:.1f}s in the model)'.format(
+        len(source), elapsed, stats['images_per_sec'], time_model))
+    return stats
+
+
+class MicroBatcher:
+    """
+    Serve single-image requests from many threads with one model, grouping them into micro-batches.
+
+    A background thread takes the first waiting request, then whatever else arrives
+    within max_delay (up to max_batch_size requests), and runs them through the model
+    in one call. A lone request waits at most max_delay; under concurrent load the
+    model runs on batches instead of one image at a time.
+
+    Usage:
+        with MicroBatcher(model) as batcher:
+            probabilities = batcher.predict(image)
+    """
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_delay=MAX_DELAY, image_size=(28, 28)):
+        """
+        Args:
+            model: Keras model, or the path of a saved one.
+            max_batch_size (int): Most requests per model call.
+            max_delay (float): Seconds to wait for more requests once one arrived.
+            image_size (tuple): (width, height) of the model input.
+        """
+        self.model = load_model(model) if isinstance(model, str) else model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.image_size = image_size
+        self.batch_sizes = collections.Counter()
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            requests = [request]
+            deadline = time.perf_counter() + self.max_delay
+            while len(requests) < self.max_batch_size:
+                try:
+                    request = self._requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    # Finish the pending batch, then stop
+                    self._requests.put(None)
+                    break
+                requests.append(request)
+
+            self.batch_sizes[len(requests)] += 1
+            try:
+                with profiling.stage('predict'):
+                    batch = _predict(self.model, np.concatenate([images for images, _ in requests]))
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            for i, (_, future) in enumerate(requests):
+                future.set_result(batch[i])
+
+    def submit(self, image):
+        """
+        Queue one image (PIL image or 2D uint8 array) and return a Future of its probabilities.
+        """
+        future = Future()
+        self._requests.put((normalize_images([image], self.image_size), future))
+        return future
+
+    def predict(self, image, timeout=None):
+        """Return the probabilities of one image, blocking until its micro-batch ran."""
+        return self.submit(image).result(timeout)
+
+    def close(self):
+        """Answer the queued requests and stop the background thread."""
+        self._requests.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def serve(model, host='127.0.0.1', port=8000, class_names=None, **batcher_options):
+    """
+    Answer classification requests over local HTTP until interrupted.
+
+    POST /predict with an encoded image (PNG or JPEG) as the body returns
+    {"label": ..., "confidence": ..., "probabilities": [...]}. Every connection is
+    handled on its own thread and all of them share one MicroBatcher.
+
+    Args:
+        model: Keras model, or the path of a saved one.
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        class_names (list): Optional name of every class, returned instead of the class index.
+        **batcher_options: max_batch_size, max_delay or image_size of the MicroBatcher.
+    """
+    batcher = MicroBatcher(model, **batcher_options)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/predict':
+                self.send_error(404)
+                return
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with Image.open(io.BytesIO(body)) as img:
+                    probabilities = batcher.predict(img.convert('L'))
+            except Exception as e:
+                self.send_error(400, str(e))
+                return
+            label = int(probabilities.argmax())
+            reply = json.dumps({'label': class_names[label] if class_names is not None else label,
+                                'confidence': float(probabilities[label]),
+                                'probabilities': probabilities.tolist()}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print('serving {} on http://{}:{}/predict'.format(model if isinstance(model, str) else 'model', host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Classify fraction images with a saved Keras model.')
+    parser.add_argument('model', help='saved model file or directory')
+    parser.add_argument('source', nargs='?', help='directory of images or shards to classify')
+    parser.add_argument('--output', default='predictions.npz', help='predictions file (.npz or .csv)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='images per model call')
+    parser.add_argument('--workers', type=int, help='decoding threads (default: one per core)')
+    parser.add_argument('--classes', nargs='+', help='name of every class, in output order')
+    parser.add_argument('--serve', action='store_true', help='answer POST /predict requests instead')
+    parser.add_argument('--port', type=int, default=8000, help='port of --serve')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.model, port=args.port, class_names=args.classes)
+    elif args.source is None:
+        parser.error('a source directory is required unless --serve is given')
+    else:
+        run_inference(args.model, args.source, args.output, args.batch_size, num_workers=args.workers,
+                      class_names=args.classes)
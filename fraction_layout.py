@@ -0,0 +1,307 @@
+import functools
+
+import numpy as np
+
+from digit_bank import BAR_CLASS
+from fraction_compositor import BAR_WIDTH_FACTOR, _trunc, compose, resize_bar
+
+# Number of layout templates kept by layout_template
+TEMPLATE_CACHE_SIZE = 65536
+
+# Space between the whole part of a mixed number and its fraction, in pixels
+MIXED_SPACE = 4
+
+# Fractions laid out by the rules of the scripts, keyed by the digit counts of (numerator, denominator);
+# only these keep the scripts' wrap of a negative column around to the end of the row
+FRACTION_FAMILIES = {(1, 1): 'a_over_b', (1, 2): 'a_over_ab', (2, 2): 'ab_over_ab'}
+
+
+def _split_top_level(text, separator):
+    """Return the positions of separator outside of any parentheses."""
+    depth = 0
+    positions = []
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0:
+                raise ValueError('unbalanced parentheses in {!r}'.format(text))
+        elif char == separator and depth == 0:
+            positions.append(i)
+    if depth != 0:
+        raise ValueError('unbalanced parentheses in {!r}'.format(text))
+    return positions
+
+
+def _parse_term(text):
+    text = text.strip()
+    if text.isdigit():
+        return ('line', text)
+    if text.startswith('(') and text.endswith(')'):
+        return _parse_expression(text[1:-1])
+    raise ValueError('invalid fraction term: {!r}'.format(text))
+
+
+def _parse_expression(text):
+    text = text.strip()
+    spaces = _split_top_level(text, ' ')
+    if spaces:
+        whole, fraction = text[:spaces[0]], text[spaces[0] + 1:]
+        if not whole.isdigit():
+            raise ValueError('invalid whole part of a mixed number: {!r}'.format(text))
+        return ('mixed', ('line', whole), _parse_expression(fraction))
+    slashes = _split_top_level(text, '/')
+    if len(slashes) != 1:
+        raise ValueError('expected exactly one top-level "/" in {!r}'.format(text))
+    return ('fraction', _parse_term(text[:slashes[0]]), _parse_term(text[slashes[0] + 1:]))
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_layout(spec):
+    """
+    Parse a fraction spec into a layout tree.
+
+    Specs are a numerator and a denominator of any number of digits ('123/4567'),
+    a mixed number with a whole part ('3 1/4'), or stacked fractions whose terms are
+    parenthesized specs ('(1/2)/(3/4)', '(1 1/2)/7').
+
+    Args:
+        spec (str): Fraction spec.
+
+    Returns:
+        tuple: Nested ('line', digits), ('fraction', top, bottom) and ('mixed', whole, fraction) nodes.
+    """
+    return _parse_expression(str(spec))
+
+
+def _collect(node, digits, num_bars):
+    kind = node[0]
+    if kind == 'line':
+        digits.extend(int(d) for d in node[1])
+        return num_bars
+    if kind == 'mixed':
+        digits.extend(int(d) for d in node[1][1])
+        return _collect(node[2], digits, num_bars)
+    num_bars = _collect(node[1], digits, num_bars)
+    return _collect(node[2], digits, num_bars + 1)
+
+
+def glyph_classes(spec):
+    """
+    Return the class of every glyph of a spec: the digits in reading order, then one
+    fraction bar per fraction, from top to bottom.
+
+    Args:
+        spec (str): Fraction spec, e.g. '12/345' or '(1/2)/(3/4)'.
+
+    Returns:
+        list: Digits (int) followed by BAR_CLASS entries.
+    """
+    digits = []
+    num_bars = _collect(parse_layout(spec), digits, 0)
+    return digits + [BAR_CLASS] * num_bars
+
+
+def script_family(spec):
+    """
+    Return the script family of a spec: 'a_over_b', 'a_over_ab', 'ab_over_ab', or None for any other shape.
+
+    Args:
+        spec (str): Fraction spec.
+    """
+    node = parse_layout(spec)
+    if node[0] != 'fraction' or node[1][0] != 'line' or node[2][0] != 'line':
+        return None
+    return FRACTION_FAMILIES.get((len(node[1][1]), len(node[2][1])))
+
+
+def _line_columns(widths, col_num, space_btw_ab):
+    """
+    Place the digits of a line anchored on the middle of a container col_num wide.
+
+    A single digit is centered. Otherwise the middle digit (odd count) is centered, or
+    the gap between the two middle digits (even count) sits at the middle, and the
+    other digits follow outwards 2 * space_btw_ab apart: the rules of the a/b, a/ab and
+    ab/ab scripts for one and two digits.
+    """
+    k = len(widths)
+    cols = [0] * k
+    if k % 2:
+        m = k // 2
+        cols[m] = int(_trunc((col_num - widths[m]) / 2))
+        left, right = m - 1, m + 1
+    else:
+        m = k // 2
+        cols[m - 1] = int(_trunc(col_num / 2 - widths[m - 1])) - space_btw_ab
+        cols[m] = int(_trunc(col_num / 2)) + space_btw_ab
+        left, right = m - 2, m + 1
+    for i in range(left, -1, -1):
+        cols[i] = cols[i + 1] - 2 * space_btw_ab - widths[i]
+    for i in range(right, k):
+        cols[i] = cols[i - 1] + widths[i - 1] + 2 * space_btw_ab
+    return cols
+
+
+def _packed_columns(widths, space_btw_ab):
+    """Place the digits of a line from column 0, 2 * space_btw_ab apart."""
+    cols = np.cumsum([0] + [w + 2 * space_btw_ab for w in widths[:-1]])
+    return [int(c) for c in cols]
+
+
+class _Builder:
+    """Walks a layout tree, consuming the glyph shapes in glyph_classes order."""
+
+    def __init__(self, digit_shapes, bar_shapes, space_btw_ab, bar_width_factor):
+        self.digit_shapes = digit_shapes
+        self.bar_shapes = bar_shapes
+        self.num_digits = len(digit_shapes)
+        self.space_btw_ab = space_btw_ab
+        self.bar_width_factor = bar_width_factor
+        self.next_digit = 0
+        self.next_bar = 0
+        self.bar_lengths = [0] * len(bar_shapes)
+
+    def measure(self, node):
+        """
+        Lay out a node at the origin.
+
+        Returns:
+            tuple: (row_num, col_num, width, place) where width is the width the node counts
+            for in its parent's bar length and place(col_num) gives its placements in a
+            container of that many columns, as (glyph index, row, col) in paint order.
+        """
+        kind = node[0]
+        if kind == 'line':
+            indices = list(range(self.next_digit, self.next_digit + len(node[1])))
+            self.next_digit += len(indices)
+            heights = [self.digit_shapes[i][0] for i in indices]
+            widths = [self.digit_shapes[i][1] for i in indices]
+
+            def place(col_num):
+                return [(i, 0, col) for i, col in zip(indices, _line_columns(widths, col_num, self.space_btw_ab))]
+            return max(heights), sum(widths) + 2 * self.space_btw_ab * (len(widths) - 1), sum(widths), place
+
+        if kind == 'mixed':
+            whole_rows, whole_cols, _, place_whole = self.measure(node[1])
+            rows, cols, _, place_fraction, bar_row, bar_rows = self._measure_fraction(node[2])
+            row_whole = int(np.clip(_trunc(bar_row + bar_rows / 2 - whole_rows / 2), 0, None))
+            col_fraction = whole_cols + MIXED_SPACE
+            row_num = max(rows, row_whole + whole_rows)
+            col_num = col_fraction + cols
+
+            def place(col_num_parent):
+                offset = int(_trunc((col_num_parent - col_num) / 2))
+                # The whole part is packed from its left edge rather than centered on its middle gap
+                whole = place_whole(whole_cols)
+                packed = _packed_columns([self.digit_shapes[i][1] for i, _, _ in whole], self.space_btw_ab)
+                whole = [(i, row + row_whole, col + offset) for (i, row, _), col in zip(whole, packed)]
+                fraction = [(i, row, col + offset + col_fraction) for i, row, col in place_fraction(cols)]
+                return whole + fraction
+            return row_num, col_num, col_num, place
+
+        rows, cols, _, place_fraction, _, _ = self._measure_fraction(node)
+
+        def place(col_num_parent):
+            offset = int(_trunc((col_num_parent - cols) / 2))
+            return [(i, row, col + offset) for i, row, col in place_fraction(cols)]
+        return rows, cols, cols, place
+
+    def _measure_fraction(self, node):
+        top, bottom = node[1], node[2]
+        top_rows, _, top_width, place_top = self.measure(top)
+        bar = self.next_bar
+        self.next_bar += 1
+        bar_length, bar_rows = self.bar_shapes[bar]
+        bottom_rows, _, bottom_width, place_bottom = self.measure(bottom)
+
+        if top[0] == 'line' and bottom[0] == 'line' and len(top[1]) == 1 and len(bottom[1]) == 1:
+            # a/b: the bar keeps its own length (the rule of 3_create_simple_fraction_a_over_b.py)
+            col_num = max(top_width, bottom_width, bar_length)
+        else:
+            col_num = int(_trunc(max(top_width, bottom_width) * self.bar_width_factor))
+            bar_length = col_num
+        self.bar_lengths[bar] = bar_length
+        row_num = top_rows + bar_rows + bottom_rows
+
+        def place(col_num_box):
+            placements = place_top(col_num_box)
+            placements.append((self.num_digits + bar, top_rows, int(_trunc((col_num_box - bar_length) / 2))))
+            placements += [(i, row + top_rows + bar_rows, col) for i, row, col in place_bottom(col_num_box)]
+            return placements
+        return row_num, col_num, col_num, place, top_rows, bar_rows
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def layout_template(spec, digit_shapes, bar_shapes, space_btw_ab=1, bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Compute the placements of every glyph of a fraction, once per combination of glyph shapes.
+
+    The result only depends on the arguments, so it is cached and reused by every
+    sample whose glyphs have the same shapes.
+
+    Args:
+        spec (str): Fraction spec (see parse_layout).
+        digit_shapes (tuple): (rows, cols) of every digit, in glyph_classes order.
+        bar_shapes (tuple): (length, thickness) of every upright bar, i.e. its (rows, cols)
+            before being laid down, in glyph_classes order.
+        space_btw_ab (int): Space between two digits of a line is 2 * space_btw_ab.
+        bar_width_factor (float): Width of a fraction relative to its widest line.
+
+    Returns:
+        tuple: ((row_num, col_num), placements, bar_lengths) where placements lists
+        (glyph index, row, col) in paint order, glyph indices counting the digits then
+        the bars, and bar_lengths gives the length every bar is stretched to.
+    """
+    builder = _Builder(digit_shapes, bar_shapes, space_btw_ab, bar_width_factor)
+    row_num, col_num, _, place = builder.measure(parse_layout(spec))
+    placements = tuple(place(col_num))
+    return (row_num, col_num), placements, tuple(builder.bar_lengths)
+
+
+def spec_file_prefix(spec):
+    """
+    Return the file name prefix of a spec, e.g. '4_over_92', '3_and_1_over_4' or
+    'open_1_over_2_close_over_open_3_over_4_close' for '(1/2)/(3/4)'.
+
+    Every digit stays a part of its own between '_', so parse_fraction_labels recovers them.
+
+    Args:
+        spec (str): Fraction spec.
+    """
+    parse_layout(spec)
+    prefix = ' '.join(str(spec).split())
+    for token, name in ((' ', '_and_'), ('/', '_over_'), ('(', 'open_'), (')', '_close')):
+        prefix = prefix.replace(token, name)
+    return prefix
+
+
+def compose_spec(spec, digit_glyphs, bar_glyphs, space_btw_ab=1, blend_max=False, bar_width_factor=BAR_WIDTH_FACTOR):
+    """
+    Compose a fraction of any spec from its glyphs.
+
+    Args:
+        spec (str): Fraction spec, e.g. '123/45', '3 1/4' or '(1/2)/(3/4)'.
+        digit_glyphs (list): Image of every digit, in glyph_classes order.
+        bar_glyphs (list): Image of every upright fraction bar, in glyph_classes order.
+        space_btw_ab (int): Space between two digits of a line is 2 * space_btw_ab.
+        blend_max (bool): Max-blend overlapping glyphs.
+        bar_width_factor (float): Width of a fraction relative to its widest line.
+
+    Returns:
+        np.array: Numpy array representing the fraction.
+
+    Raises:
+        IndexError: A glyph does not fit inside the fraction.
+    """
+    digit_shapes = tuple(tuple(g.shape) for g in digit_glyphs)
+    bar_shapes = tuple(tuple(g.shape) for g in bar_glyphs)
+    shape, placements, bar_lengths = layout_template(spec, digit_shapes, bar_shapes, space_btw_ab, bar_width_factor)
+
+    # Lay every bar down at its length (an a/b bar keeps its own length and is only transposed)
+    bars = [g.T if g.shape[0] == length else resize_bar(g, length) for g, length in zip(bar_glyphs, bar_lengths)]
+    glyphs = list(digit_glyphs) + bars
+    if script_family(spec) is None and any(col < 0 for _, _, col in placements):
+        raise IndexError('glyphs of {!r} do not fit in a fraction of shape {}'.format(spec, shape))
+    layout = (shape, [(row, col) for _, row, col in placements])
+    return compose(layout, [glyphs[i] for i, _, _ in placements], blend_max)
@@ -0,0 +1,217 @@
+import os
+
+import numpy as np
+
+from fraction_layout import spec_file_prefix
+
+# Longest fraction spec (label) stored in a shard index
+SPEC_LENGTH = 32
+
+# Index entry of every image of a shard: where its pixels start in the shard buffer, its shape and its label
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('rows', '<i4'), ('cols', '<i4'), ('spec', '<U{}'.format(SPEC_LENGTH)),
+                        ('id', '<i8')])
+
+
+def _check_specs(specs):
+    """Raise ValueError for a spec the index would truncate."""
+    for spec in np.unique(np.asarray(specs, dtype=str)):
+        if len(spec) > SPEC_LENGTH:
+            raise ValueError('spec {!r} is longer than the {} characters of a shard index'.format(
+                str(spec), SPEC_LENGTH))
+
+# Default number of images per shard written by ShardWriter
+SHARD_SIZE = 10000
+
+
+def write_shard(path_shard, images, shapes, specs, ids, meta=None):
+    """
+    Write images losslessly into one shard: '<path_shard>.npy' holding the raw uint8
+    pixels of every image back to back, and '<path_shard>.index.npy' holding the index.
+    Optional per-image metadata is saved as '<path_shard>.meta.npy'.
+
+    Both files are written under a temporary name first and renamed, so a shard
+    either exists completely or not at all.
+
+    Args:
+        path_shard (str): Path of the shard without extension.
+        images (np.array or list): Padded (n, H, W) batch or a list of 2D uint8 arrays.
+        shapes (np.array): Valid (rows, cols) of each image.
+        specs (list or str): Label (fraction spec) of each image, or one spec for all of them.
+        ids (np.array): Sample id of each image.
+        meta (np.array): Optional structured array with one row per image, e.g. augmentation parameters.
+
+    Raises:
+        ValueError: A spec is longer than SPEC_LENGTH characters.
+    """
+    _check_specs(specs)
+    shapes = np.asarray(shapes, dtype=np.int64).reshape(-1, 2)
+    index = np.zeros(len(shapes), dtype=INDEX_DTYPE)
+    index['rows'] = shapes[:, 0]
+    index['cols'] = shapes[:, 1]
+    index['spec'] = specs
+    index['id'] = ids
+    sizes = shapes[:, 0] * shapes[:, 1]
+    np.cumsum(sizes[:-1], out=index['offset'][1:])
+
+    buffer = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for image, (row_num, col_num), offset, size in zip(images, shapes, index['offset'], sizes):
+        buffer[offset:offset + size].reshape(row_num, col_num)[...] = image[:row_num, :col_num]
+
+    arrays = [('.npy', buffer), ('.index.npy', index)]
+    if meta is not None:
+        arrays.insert(0, ('.meta.npy', meta))
+    for suffix, array in arrays:
+        with open(path_shard + suffix + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path_shard + suffix + '.tmp', path_shard + suffix)
+
+
+def write_shard_chunk(path_result, spec, start, images, shapes, meta=None):
+    """
+    Write a chunk of generated fractions as one shard; a write_chunk for the generation drivers.
+
+    The shard is named after the spec and its first sample, e.g. '4_over_92_000003000', so the
+    output does not depend on the order in which workers finish.
+
+    Args:
+        path_result (str): Directory of the shards.
+        spec (str): Fraction spec of the chunk.
+        start (int): Index of the first sample of the chunk.
+        images (np.array): Padded batch returned by render_batch.
+        shapes (np.array): Valid shape of each sample.
+        meta (np.array): Optional per-sample metadata (e.g. augmentation parameters).
+    """
+    path_shard = os.path.join(path_result, '{}_{:09d}'.format(spec_file_prefix(spec), start))
+    write_shard(path_shard, images, shapes, spec, np.arange(start, start + len(images)), meta)
+
+
+class ShardWriter:
+    """
+    Append images one batch at a time and write them out in shards of a fixed size.
+
+    Usage:
+        with ShardWriter('./fractions_shards/') as writer:
+            writer.write(images, shapes, '4/92')
+    """
+
+    def __init__(self, path_result, shard_size=SHARD_SIZE, prefix='shard'):
+        self.path_result = path_result
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.num_shards = 0
+        self.num_written = 0
+        self._pending = []
+        self._num_pending = 0
+        os.makedirs(path_result, exist_ok=True)
+
+    def write(self, images, shapes, specs):
+        """
+        Queue a copy of a batch of images, writing full shards as they fill up.
+
+        Args:
+            images (np.array or list): Padded (n, H, W) batch or a list of 2D uint8 arrays.
+            shapes (np.array): Valid (rows, cols) of each image.
+            specs (list or str): Label of each image, or one label for all of them.
+        """
+        _check_specs(specs)
+        shapes = np.asarray(shapes, dtype=np.int64).reshape(-1, 2)
+        specs = np.broadcast_to(np.asarray(specs, dtype=INDEX_DTYPE['spec']), len(shapes))
+        for image, shape, spec in zip(images, shapes, specs):
+            # Keep a copy of the valid pixels: the caller may reuse its batch buffer before the shard is written
+            self._pending.append((np.array(image[:shape[0], :shape[1]], copy=True), shape, spec))
+            self._num_pending += 1
+            if self._num_pending == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        """Write the queued images as a (possibly smaller) shard."""
+        if not self._pending:
+            return
+        images, shapes, specs = zip(*self._pending)
+        path_shard = os.path.join(self.path_result, '{}_{:06d}'.format(self.prefix, self.num_shards))
+        write_shard(path_shard, images, shapes, list(specs), np.arange(self.num_written, self.num_written + len(images)))
+        self.num_shards += 1
+        self.num_written += len(images)
+        self._pending = []
+        self._num_pending = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShardReader:
+    """
+    Memory-mapped, zero-copy access to every shard of a directory.
+
+    Images are returned as views on the memory-mapped shard buffers; nothing is
+    read from disk until the pixels are used.
+
+    Attributes:
+        index (np.array): Concatenated index of all shards (INDEX_DTYPE), with a 'shard' field added.
+        meta (np.array): Concatenated metadata of all shards, or None unless every shard has some.
+    """
+
+    def __init__(self, path_result):
+        names = sorted(f[:-len('.index.npy')] for f in os.listdir(path_result) if f.endswith('.index.npy'))
+        self.paths = [os.path.join(path_result, name) for name in names]
+        self.buffers = [np.load(path + '.npy', mmap_mode='r') for path in self.paths]
+        indexes = [np.load(path + '.index.npy') for path in self.paths]
+
+        dtype = np.dtype(INDEX_DTYPE.descr + [('shard', '<i4')])
+        self.index = np.zeros(sum(len(i) for i in indexes), dtype=dtype)
+        position = 0
+        for shard, index in enumerate(indexes):
+            block = self.index[position:position + len(index)]
+            for name in INDEX_DTYPE.names:
+                block[name] = index[name]
+            block['shard'] = shard
+            position += len(index)
+
+        self.meta = None
+        if self.paths and all(os.path.exists(path + '.meta.npy') for path in self.paths):
+            self.meta = np.concatenate([np.load(path + '.meta.npy') for path in self.paths])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """Return image i as a (rows, cols) view on its shard."""
+        entry = self.index[i]
+        offset, row_num, col_num = int(entry['offset']), int(entry['rows']), int(entry['cols'])
+        return self.buffers[entry['shard']][offset:offset + row_num * col_num].reshape(row_num, col_num)
+
+    @property
+    def specs(self):
+        """Label (fraction spec) of every image."""
+        return self.index['spec']
+
+    @property
+    def shapes(self):
+        """Valid (rows, cols) of every image."""
+        return np.stack([self.index['rows'], self.index['cols']], axis=1)
+
+    def read_batch(self, indices, out_shape=None):
+        """
+        Copy some images into one padded batch, the layout returned by render_batch.
+
+        Args:
+            indices (iterable): Positions of the images.
+            out_shape (tuple): (H, W) of the batch; defaults to the largest image.
+
+        Returns:
+            tuple: (images, shapes) with images of shape (n, H, W) uint8.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        shapes = self.shapes[indices]
+        if out_shape is None:
+            out_shape = tuple(shapes.max(axis=0)) if len(shapes) else (0, 0)
+        images = np.zeros((len(indices),) + tuple(int(s) for s in out_shape), dtype=np.uint8)
+        for image, i, (row_num, col_num) in zip(images, indices, shapes):
+            image[:row_num, :col_num] = self[i]
+        return images, shapes
@@ -0,0 +1,190 @@
+import collections
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+import numpy as np
+
+from digit_bank import load_digit_bank
+from fraction_augment import AUGMENT_DTYPE, render_augmented_batch
+from fraction_batch import render_batch
+from post_processing import postprocess_batch
+
+# Digit bank of the current worker process, loaded once by _init_worker
+_worker_bank = None
+
+
+def normalize_batch(images, shapes, image_size=(28, 28)):
+    """
+    Resize every fraction of a padded batch and scale it to [0, 1], like the notebook loaders.
+
+    Each image is cropped to its valid shape and resized with PIL's default filter,
+    so the output matches what preprocess_fraction_dataset computes from the files.
+
+    Args:
+        images (np.array): Padded (n, H, W) uint8 batch.
+        shapes (np.array): Valid (rows, cols) of each image.
+        image_size (tuple): (width, height) of the output, as for PIL's resize.
+
+    Returns:
+        np.array: float32 array of shape (n, height, width, 1).
+    """
+    out = np.empty((len(images), image_size[1], image_size[0], 1), dtype=np.float32)
+    for i, (image, (row_num, col_num)) in enumerate(zip(images, shapes)):
+        img = Image.fromarray(np.ascontiguousarray(image[:row_num, :col_num]), 'L')
+        out[i, :, :, 0] = np.asarray(img.resize(image_size))
+    out /= 255.0
+    return out
+
+
+def render_training_batch(bank, specs, batch_size, rng, image_size=(28, 28), space_btw_ab=1, weights=None,
+                          postprocess=None, augment=None, return_params=False):
+    """
+    Synthesize one batch of normalized fractions with mixed labels.
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        specs (list): Fraction specs; the label of a sample is the position of its spec.
+        batch_size (int): Number of samples.
+        rng (np.random.Generator): Random generator.
+        image_size (tuple): (width, height) of the output images.
+        space_btw_ab (int): Space between the two digits of a two-digit line.
+        weights (list): Optional probability of each spec (uniform by default).
+        postprocess (dict): Optional keyword arguments of post_processing.postprocess_batch.
+        augment (dict): Optional keyword arguments of fraction_augment.render_augmented_batch.
+        return_params (bool): Also return the augmentation parameters of every sample (needs augment).
+
+    Returns:
+        tuple: (images, labels) with images float32 of shape (batch_size, height, width, 1) and int64 labels,
+        plus the AUGMENT_DTYPE parameters of every sample with return_params.
+    """
+    if return_params and not augment:
+        raise ValueError('return_params needs augment')
+    labels = rng.choice(len(specs), size=batch_size, p=weights)
+    images = np.empty((batch_size, image_size[1], image_size[0], 1), dtype=np.float32)
+    params = np.zeros(batch_size, dtype=AUGMENT_DTYPE) if return_params else None
+    for label in np.unique(labels):
+        idx = np.flatnonzero(labels == label)
+        if augment:
+            raw, shapes, meta = render_augmented_batch(bank, specs[label], len(idx), rng, space_btw_ab, **augment)
+            if return_params:
+                params[idx] = meta
+        else:
+            raw, shapes = render_batch(bank, specs[label], len(idx), rng, space_btw_ab)
+        if postprocess:
+            raw = postprocess_batch(raw, shapes, rng, **postprocess)
+        images[idx] = normalize_batch(raw, shapes, image_size)
+    if return_params:
+        return images, labels.astype(np.int64), params
+    return images, labels.astype(np.int64)
+
+
+def _init_worker(path_bank):
+    global _worker_bank
+    _worker_bank = load_digit_bank(path_bank)
+
+
+def _render_task(specs, batch_size, seed, batch_index, image_size, space_btw_ab, weights, postprocess, augment,
+                 return_params):
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch_index,)))
+    return render_training_batch(_worker_bank, specs, batch_size, rng, image_size, space_btw_ab, weights,
+                                 postprocess, augment, return_params)
+
+
+class FractionStream:
+    """
+    Iterable of freshly synthesized training batches, rendered in background processes.
+
+    Nothing is written to disk: every batch is generated on demand from the digit
+    bank, so memory stays constant however many batches are drawn. Batch k is seeded
+    from (seed, k), so the stream is reproducible and independent of num_workers.
+
+    Usage:
+        stream = FractionStream('./digits/digit_bank.npz', ['4/9', '4/92', '41/92'], batch_size=32)
+        model.fit(iter(stream), steps_per_epoch=1000, epochs=10)
+
+    With return_params the batches are (images, labels, params) instead, which Keras
+    would read as sample weights; keep it off for model.fit.
+    """
+
+    def __init__(self, path_bank, specs, batch_size=32, seed=0, num_batches=None, image_size=(28, 28),
+                 space_btw_ab=1, num_workers=2, prefetch=8, weights=None, postprocess=None,
+                 augment=None, return_params=False):
+        """
+        Args:
+            path_bank (str): Path to the digit bank file.
+            specs (list): Fraction specs; the label of a sample is the position of its spec.
+            batch_size (int): Samples per batch.
+            seed (int): Master seed of the stream.
+            num_batches (int): Stop after this many batches; None streams forever.
+            image_size (tuple): (width, height) of the output images.
+            space_btw_ab (int): Space between the two digits of a two-digit line.
+            num_workers (int): Background processes; 0 renders in the consuming thread.
+            prefetch (int): Batches rendered ahead of the consumer.
+            weights (list): Optional probability of each spec (uniform by default).
+            postprocess (dict): Optional post-processing of every batch, e.g. {'invert': True, 'noise': 8}
+                (keyword arguments of post_processing.postprocess_batch).
+            augment (dict): Optional random spacing, jitter, bar and affine augmentations, e.g.
+                fraction_augment.DEFAULT_AUGMENT.
+            return_params (bool): Yield (images, labels, params) with the AUGMENT_DTYPE parameters of every
+                sample (needs augment).
+        """
+        if return_params and not augment:
+            raise ValueError('return_params needs augment')
+        self.path_bank = path_bank
+        self.specs = list(specs)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.num_batches = num_batches
+        self.image_size = tuple(image_size)
+        self.space_btw_ab = space_btw_ab
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.weights = weights
+        self.postprocess = postprocess
+        self.augment = augment
+        self.return_params = return_params
+        self.epoch = 0
+
+    @property
+    def class_names(self):
+        """Spec of each label."""
+        return self.specs
+
+    def __len__(self):
+        if self.num_batches is None:
+            raise TypeError('infinite stream has no length')
+        return self.num_batches
+
+    def _task_args(self, batch_index):
+        # Successive passes over a finite stream draw fresh samples
+        seed = [self.seed, self.epoch] if self.num_batches is not None else self.seed
+        return (self.specs, self.batch_size, seed, batch_index, self.image_size, self.space_btw_ab, self.weights,
+                self.postprocess, self.augment, self.return_params)
+
+    def __iter__(self):
+        batch_indices = itertools.count() if self.num_batches is None else iter(range(self.num_batches))
+        try:
+            if self.num_workers <= 0:
+                _init_worker(self.path_bank)
+                for batch_index in batch_indices:
+                    yield _render_task(*self._task_args(batch_index))
+                return
+
+            with ProcessPoolExecutor(self.num_workers, initializer=_init_worker,
+                                     initargs=(self.path_bank,)) as executor:
+                pending = collections.deque()
+                try:
+                    for batch_index in itertools.islice(batch_indices, self.prefetch):
+                        pending.append(executor.submit(_render_task, *self._task_args(batch_index)))
+                    while pending:
+                        batch = pending.popleft().result()
+                        for batch_index in itertools.islice(batch_indices, 1):
+                            pending.append(executor.submit(_render_task, *self._task_args(batch_index)))
+                        yield batch
+                finally:
+                    # The consumer may stop early; drop the batches rendered ahead
+                    for future in pending:
+                        future.cancel()
+        finally:
+            self.epoch += 1
@@ -0,0 +1,184 @@
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+from digit_bank import get_digit_bank
+from fraction_layout import FRACTION_FAMILIES
+from fraction_shards import write_shard_chunk
+from parallel_generation import CHUNK_SIZE, iter_completed_tasks, plan_tasks, write_jpeg_chunk
+
+# Number of digits of the numerator and denominator of each fraction family, keyed 'a/b', 'a/ab', 'ab/ab'
+FAMILY_DIGITS = {name.replace('_over_', '/'): digits for digits, name in FRACTION_FAMILIES.items()}
+
+
+def expand_grid(grid):
+    """
+    Expand a grid spec into the number of samples of every fraction.
+
+    Each entry of the grid describes one fraction family:
+        {'family': 'a/b', 'count': 100}                      every a/b for a, b in 0-9
+        {'family': 'ab/ab', 'count': 50, 'sample': 200}      200 distinct random ab/ab pairs
+        {'family': 'a/ab', 'count': 20, 'specs': ['4/92']}   an explicit list of fractions
+    An optional 'digits' list restricts the digits used (0-9 by default) and 'seed'
+    makes the sampled pairs reproducible.
+
+    Args:
+        grid (list): Grid entries as above.
+
+    Returns:
+        dict: Maps each spec (e.g. '4/92') to its number of samples, in grid order.
+    """
+    counts = {}
+    for entry in grid:
+        if 'specs' in entry:
+            specs = list(entry['specs'])
+        else:
+            len_nume, len_deno = FAMILY_DIGITS[entry['family']]
+            digits = [str(d) for d in entry.get('digits', range(10))]
+            specs = [''.join(p[:len_nume]) + '/' + ''.join(p[len_nume:])
+                     for p in itertools.product(digits, repeat=len_nume + len_deno)]
+            if 'sample' in entry:
+                specs = random.Random(entry.get('seed', 0)).sample(specs, min(entry['sample'], len(specs)))
+        for spec in specs:
+            counts[spec] = counts.get(spec, 0) + entry['count']
+    return counts
+
+
+def format_progress(num_done, num_total, elapsed):
+    """
+    Format a progress line with rate and estimated time remaining.
+
+    Args:
+        num_done (int): Samples generated so far in this run.
+        num_total (int): Samples to generate in this run.
+        elapsed (float): Seconds since the start of this run.
+
+    Returns:
+        str: e.g. '500/1000 (50.0%) 10 samples/sec, ETA 00:00:50', with a day count ('1d 02:00:00') past 24 hours.
+    """
+    rate = num_done / elapsed if elapsed > 0 else 0.0
+    eta = (num_total - num_done) / rate if rate > 0 else 0.0
+    # Split the ETA by hand, as strftime would wrap around after 24 hours
+    minutes, seconds = divmod(int(eta), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    eta_text = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+    if days:
+        eta_text = '{}d {}'.format(days, eta_text)
+    return '{}/{} ({:.1f}%) {:.0f} samples/sec, ETA {}'.format(
+        num_done, num_total, 100.0 * num_done / max(num_total, 1), rate, eta_text)
+
+
+def _checkpoint_settings(settings):
+    """
+    Return the settings as they read back from a checkpoint: tuples, ranges and other
+    iterables (e.g. 'digits': range(5)) become lists, so a resumed run compares equal.
+    """
+    return json.loads(json.dumps(settings, default=list))
+
+
+def _read_checkpoint(path_checkpoint, settings):
+    """Return the (spec, chunk_index) pairs already completed by a run with the same settings."""
+    if not os.path.exists(path_checkpoint):
+        return set()
+    with open(path_checkpoint) as f:
+        lines = f.read().splitlines()
+    if not lines or json.loads(lines[0]) != settings:
+        raise ValueError('checkpoint {} was written with different settings'.format(path_checkpoint))
+    done = set()
+    for line in lines[1:]:
+        spec, _, chunk_index = line.rpartition(' ')
+        if spec:
+            done.add((spec, int(chunk_index)))
+    return done
+
+
+def generate_grid(path_bank, grid, path_result, seed=0, path_checkpoint=None, num_workers=1, space_btw_ab=1,
+                  chunk_size=CHUNK_SIZE, write_chunk=write_jpeg_chunk, show_progress=True, postprocess=None,
+                  augment=None, unique=False):
+    """
+    Generate every fraction of a grid in one run, loading the digit bank once.
+
+    Completed chunks are appended to a checkpoint file, so an interrupted run
+    started again with the same settings resumes where it stopped and produces
+    the same samples.
+
+    Args:
+        path_bank (str): Path to the digit bank file.
+        grid (list): Grid entries (see expand_grid).
+        path_result (str): Directory to save the generated fraction images.
+        seed (int): Master seed.
+        path_checkpoint (str): Checkpoint file; defaults to 'checkpoint.txt' in path_result.
+        num_workers (int): Worker processes; 0 or 1 runs in this process.
+        space_btw_ab (int): Space between the two digits of a two-digit line.
+        chunk_size (int): Samples per chunk (the unit of checkpointing).
+        write_chunk (callable): Called as write_chunk(path_result, spec, start, images, shapes) for every chunk.
+        show_progress (bool): Print a progress/ETA line after every chunk.
+        postprocess (dict): Optional keyword arguments of post_processing.postprocess_batch, applied to every chunk.
+        augment (dict): Optional keyword arguments of fraction_augment.render_augmented_batch.
+        unique (bool): Draw unique glyph combinations spread over the glyph pools (see sampling_index.SamplingIndex).
+
+    Returns:
+        dict: Samples generated in this run, samples skipped thanks to the checkpoint, elapsed seconds.
+    """
+    os.makedirs(path_result, exist_ok=True)
+    if path_checkpoint is None:
+        path_checkpoint = os.path.join(path_result, 'checkpoint.txt')
+
+    counts = expand_grid(grid)
+    settings = {'path_bank': path_bank, 'grid': grid, 'seed': seed, 'space_btw_ab': space_btw_ab,
+                'chunk_size': chunk_size}
+    if postprocess:
+        settings['postprocess'] = postprocess
+    if augment:
+        settings['augment'] = augment
+    if unique:
+        settings['unique'] = True
+    settings = _checkpoint_settings(settings)
+    done = _read_checkpoint(path_checkpoint, settings)
+    tasks = plan_tasks(list(counts), counts, chunk_size)
+    todo = [task for task in tasks if (task[0], task[1]) not in done]
+    num_skipped = sum(task[3] for task in tasks) - sum(task[3] for task in todo)
+    num_total = sum(task[3] for task in todo)
+
+    if not os.path.exists(path_checkpoint):
+        with open(path_checkpoint, 'w') as f:
+            f.write(json.dumps(settings) + '\n')
+
+    num_done = 0
+    time_start = time.perf_counter()
+    with open(path_checkpoint, 'a') as checkpoint:
+        for spec, chunk_index, start, count in iter_completed_tasks(
+                path_bank, todo, seed, num_workers, space_btw_ab, path_result, write_chunk, postprocess, augment,
+                unique, counts):
+            checkpoint.write('{} {}\n'.format(spec, chunk_index))
+            checkpoint.flush()
+            num_done += count
+            if show_progress:
+                sys.stdout.write('\r' + format_progress(num_done, num_total, time.perf_counter() - time_start))
+                sys.stdout.flush()
+    if show_progress:
+        sys.stdout.write('\n')
+
+    return {'num_sample': num_done, 'num_skipped': num_skipped, 'seconds': time.perf_counter() - time_start}
+
+
+if __name__ == '__main__':
+    # Settings: the full training grid
+    grid = [
+        {'family': 'a/b', 'count': 1000},
+        {'family': 'a/ab', 'count': 500},
+        {'family': 'ab/ab', 'count': 500, 'sample': 1000, 'seed': 0},
+    ]
+    seed = 0
+    path_data = './digits/processed/'
+    path_mnist = './Data/MNIST/'
+    path_bank = './digits/digit_bank.npz'
+    path_result = './fractions/'
+
+    # Build the bank here on first use, before the workers load it from path_bank
+    get_digit_bank(path_bank, path_data, path_mnist)
+    generate_grid(path_bank, grid, path_result, seed, num_workers=os.cpu_count(), write_chunk=write_shard_chunk)
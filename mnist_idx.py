@@ -0,0 +1,148 @@
+import gzip
+import os
+import struct
+
+import numpy as np
+
+# Data type codes of the IDX format (http://yann.lecun.com/exdb/mnist/), stored big-endian
+IDX_DTYPES = {
+    0x08: np.dtype('u1'),
+    0x09: np.dtype('i1'),
+    0x0B: np.dtype('>i2'),
+    0x0C: np.dtype('>i4'),
+    0x0D: np.dtype('>f4'),
+    0x0E: np.dtype('>f8'),
+}
+
+# Base names of the original MNIST files for each split
+MNIST_FILES = {
+    'train': ('train-images-idx3-ubyte', 'train-labels-idx1-ubyte'),
+    't10k': ('t10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte'),
+}
+
+
+def parse_idx_header(header):
+    """
+    Parse the magic number and dimensions at the start of an IDX file.
+
+    Args:
+        header (bytes): The first bytes of the file (at least 4 + 4 * ndim).
+
+    Returns:
+        tuple: (dtype, shape, offset) where offset is the size of the header in bytes.
+    """
+    zero, dtype_code, ndim = struct.unpack('>HBB', header[:4])
+    if zero != 0 or dtype_code not in IDX_DTYPES:
+        raise ValueError('not an IDX file (magic number {:#010x})'.format(struct.unpack('>I', header[:4])[0]))
+    offset = 4 + 4 * ndim
+    shape = struct.unpack('>' + 'I' * ndim, header[4:offset])
+    return IDX_DTYPES[dtype_code], shape, offset
+
+
+def load_idx(path_idx):
+    """
+    Load an IDX file as a numpy array without copying the data.
+
+    Raw files are memory-mapped read-only. Gzipped files (``.gz``) cannot be mapped,
+    so they are decompressed once and the array is a view on the decompressed buffer.
+
+    Args:
+        path_idx (str): Path to the IDX file, optionally gzipped.
+
+    Returns:
+        np.array: Array with the dtype and shape stored in the file header.
+    """
+    if path_idx.endswith('.gz'):
+        with gzip.open(path_idx, 'rb') as f:
+            buffer = f.read()
+        dtype, shape, offset = parse_idx_header(buffer)
+        return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    with open(path_idx, 'rb') as f:
+        header = f.read(4 + 4 * 255)
+    dtype, shape, offset = parse_idx_header(header)
+    return np.memmap(path_idx, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+
+
+def find_idx_file(path_mnist, base_name):
+    """
+    Locate an MNIST file in a directory, accepting the raw or gzipped name and the
+    ``train-images.idx3-ubyte`` spelling used by some mirrors.
+
+    Args:
+        path_mnist (str): Directory holding the MNIST files.
+        base_name (str): Base name of the file, e.g. 'train-images-idx3-ubyte'.
+
+    Returns:
+        str: Path to the first matching file.
+    """
+    path_idx = _locate_idx_file(path_mnist, base_name)
+    if path_idx is None:
+        raise FileNotFoundError('{} not found in {}'.format(base_name, path_mnist))
+    return path_idx
+
+
+def _locate_idx_file(path_mnist, base_name):
+    stem, _, suffix = base_name.rpartition('-')
+    for name in (base_name, stem[:-5] + '.' + stem[-4:] + '-' + suffix):
+        for candidate in (name, name + '.gz'):
+            path_idx = os.path.join(path_mnist, candidate)
+            if os.path.exists(path_idx):
+                return path_idx
+    return None
+
+
+def mnist_available(path_mnist, kind='all'):
+    """
+    Return whether the image and label files of an MNIST split are in a directory.
+
+    Args:
+        path_mnist (str): Directory holding the MNIST files.
+        kind (str): 'train', 't10k' or 'all'.
+    """
+    kinds = list(MNIST_FILES) if kind == 'all' else [kind]
+    return all(_locate_idx_file(path_mnist, name) is not None for k in kinds for name in MNIST_FILES[k])
+
+
+def load_mnist(path_mnist, kind='train'):
+    """
+    Load the images and labels of one MNIST split straight from its IDX files.
+
+    A single split is returned without copying (see load_idx). 'all' concatenates
+    both splits into new in-memory arrays (about 55 MB); load 'train' and 't10k'
+    one at a time to keep working on the memory maps.
+
+    Args:
+        path_mnist (str): Directory holding the MNIST files (see Data/MNIST/README.md).
+        kind (str): 'train', 't10k' or 'all' (both splits concatenated).
+
+    Returns:
+        tuple: (images, labels) with images of shape (N, 28, 28) uint8 and labels of shape (N,) uint8.
+    """
+    if kind == 'all':
+        splits = [load_mnist(path_mnist, name) for name in MNIST_FILES]
+        return np.concatenate([s[0] for s in splits]), np.concatenate([s[1] for s in splits])
+
+    name_images, name_labels = MNIST_FILES[kind]
+    images = load_idx(find_idx_file(path_mnist, name_images))
+    labels = load_idx(find_idx_file(path_mnist, name_labels))
+    if len(images) != len(labels):
+        raise ValueError('{} images but {} labels in {}'.format(len(images), len(labels), path_mnist))
+    return images, labels
+
+
+def iter_digit_classes(images, labels, list_number=range(10)):
+    """
+    Yield the images of each digit class of an MNIST split.
+
+    Args:
+        images (np.array): Images of shape (N, 28, 28).
+        labels (np.array): Labels of shape (N,).
+        list_number (iterable): Digit classes to yield.
+
+    Yields:
+        tuple: (number, index, stack) where index holds the positions of the digits in the split.
+    """
+    for number in list_number:
+        index = np.flatnonzero(labels == number)
+        yield number, index, images[index]
@@ -0,0 +1,245 @@
+import os
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PIL import Image
+import numpy as np
+
+from digit_bank import get_digit_bank, load_digit_bank
+from fraction_augment import render_augmented_batch
+from fraction_batch import render_batch, render_glyph_ids
+from fraction_layout import spec_file_prefix
+from fraction_shards import write_shard_chunk
+from post_processing import postprocess_batch
+from sampling_index import SamplingIndex
+import profiling
+
+# Number of samples rendered per task. Seeds are derived per chunk, not per worker,
+# so this (and not the worker count) determines the output.
+CHUNK_SIZE = 1000
+
+# Tasks kept in flight per worker process by iter_completed_tasks
+WINDOW_PER_WORKER = 2
+
+# Digit bank of the current worker process, loaded once by _init_worker
+_worker_bank = None
+
+# Sampling indexes of the current worker process, keyed by (spec, seed)
+_worker_indexes = {}
+
+
+def chunk_seed(seed, spec, chunk_index):
+    """
+    Derive the seed of one chunk of samples from the master seed.
+
+    The spec enters through a CRC32 of its text so that adding specs to a grid does
+    not change the samples of the others.
+
+    Args:
+        seed (int): Master seed of the run.
+        spec (str): Fraction spec of the chunk.
+        chunk_index (int): Position of the chunk within the spec.
+
+    Returns:
+        np.random.SeedSequence: Independent seed sequence for the chunk.
+    """
+    return np.random.SeedSequence(seed, spawn_key=(zlib.crc32(spec.encode('ascii')), chunk_index))
+
+
+def plan_tasks(specs, num_sample, chunk_size=CHUNK_SIZE):
+    """
+    Split the samples of every spec into chunks.
+
+    Args:
+        specs (list): Fraction specs, e.g. ['4/9', '4/92'].
+        num_sample (int or dict): Samples per spec, or a dict mapping each spec to its count.
+        chunk_size (int): Samples per chunk.
+
+    Returns:
+        list: (spec, chunk_index, start, count) tuples.
+    """
+    tasks = []
+    for spec in specs:
+        total = num_sample[spec] if isinstance(num_sample, dict) else num_sample
+        for chunk_index, start in enumerate(range(0, total, chunk_size)):
+            tasks.append((spec, chunk_index, start, min(chunk_size, total - start)))
+    return tasks
+
+
+def write_jpeg_chunk(path_result, spec, start, images, shapes, meta=None):
+    """
+    Save a rendered chunk as one JPEG per fraction, named like the scripts do.
+
+    Args:
+        path_result (str): Directory to save the generated fraction images.
+        spec (str): Fraction spec of the chunk.
+        start (int): Index of the first sample of the chunk.
+        images (np.array): Padded batch returned by render_batch.
+        shapes (np.array): Valid shape of each sample.
+        meta (np.array): Optional per-sample metadata (e.g. augmentation parameters), saved
+            as 'metadata/<prefix>_<start>.npy' in path_result; row i belongs to id start + i.
+    """
+    prefix = spec_file_prefix(spec)
+    for i, (image, (row_num, col_num)) in enumerate(zip(images, shapes)):
+        img = Image.fromarray(np.ascontiguousarray(image[:row_num, :col_num]), 'L')
+        img.save(path_result + prefix + '_id_' + str(start + i) + '.jpg')
+    if meta is not None:
+        path_meta = os.path.join(path_result, 'metadata')
+        os.makedirs(path_meta, exist_ok=True)
+        np.save(os.path.join(path_meta, '{}_{:09d}.npy'.format(prefix, start)), meta)
+
+
+def _init_worker(path_bank):
+    global _worker_bank
+    _worker_bank = load_digit_bank(path_bank)
+    _worker_indexes.clear()
+
+
+def _run_task(task, seed, space_btw_ab, path_result, write_chunk, postprocess=None, augment=None, unique=False,
+              total=None):
+    spec, chunk_index, start, count = task
+    rng = np.random.default_rng(chunk_seed(seed, spec, chunk_index))
+    with profiling.stage('render'):
+        if unique:
+            if (spec, seed) not in _worker_indexes:
+                _worker_indexes[(spec, seed)] = SamplingIndex(_worker_bank, spec, seed)
+            ids = _worker_indexes[(spec, seed)].sample_ids(start, count, total, space_btw_ab)
+            images, shapes = render_glyph_ids(_worker_bank, spec, ids, space_btw_ab)
+        elif augment:
+            images, shapes, meta = render_augmented_batch(_worker_bank, spec, count, rng, space_btw_ab, **augment)
+        else:
+            images, shapes = render_batch(_worker_bank, spec, count, rng, space_btw_ab)
+    if postprocess:
+        with profiling.stage('postprocess'):
+            images = postprocess_batch(images, shapes, rng, **postprocess)
+    with profiling.stage('write'):
+        if augment:
+            write_chunk(path_result, spec, start, images, shapes, meta)
+        else:
+            write_chunk(path_result, spec, start, images, shapes)
+    profiling.count('samples', count)
+
+
+def iter_completed_tasks(path_bank, tasks, seed, num_workers, space_btw_ab, path_result, write_chunk,
+                         postprocess=None, augment=None, unique=False, num_sample=None):
+    """
+    Run tasks in this process or across a process pool, yielding each one once it is written.
+
+    Args:
+        path_bank (str): Path to the digit bank file (loaded once per worker).
+        tasks (list): (spec, chunk_index, start, count) tuples from plan_tasks.
+        seed (int): Master seed.
+        num_workers (int): Worker processes; 0 or 1 runs in this process.
+        space_btw_ab (int): Space between the two digits of a two-digit line.
+        path_result (str): Directory (or prefix) passed on to write_chunk.
+        write_chunk (callable): Called as write_chunk(path_result, spec, start, images, shapes) for every chunk.
+        postprocess (dict): Optional keyword arguments of post_processing.postprocess_batch, applied to every chunk.
+        augment (dict): Optional keyword arguments of fraction_augment.render_augmented_batch; the parameters
+            of every sample are passed to write_chunk as a sixth argument.
+        unique (bool): Draw the glyphs from sampling_index.SamplingIndex instead of at random.
+        num_sample (dict): Samples of every spec in the whole run (tasks may be a part of it); required
+            with unique, which spreads them over the sampling order of the spec.
+
+    Yields:
+        tuple: The completed tasks, in completion order. On the first failing task the
+        queued ones are cancelled and its exception is raised.
+    """
+    if unique and augment:
+        raise ValueError('unique sampling does not support augment')
+    if unique and num_sample is None:
+        raise ValueError('unique sampling needs the num_sample of every spec')
+    totals = [num_sample[task[0]] if unique else None for task in tasks]
+    if num_workers <= 1:
+        _init_worker(path_bank)
+        for task, total in zip(tasks, totals):
+            _run_task(task, seed, space_btw_ab, path_result, write_chunk, postprocess, augment, unique, total)
+            yield task
+        return
+
+    # Keep a bounded window of tasks in flight, so a failure (or an early stop of the
+    # caller) does not leave every remaining chunk queued and run unrecorded
+    pending = iter(zip(tasks, totals))
+    executor = ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=(path_bank,))
+    try:
+        futures = {}
+        while True:
+            for task, total in pending:
+                futures[executor.submit(_run_task, task, seed, space_btw_ab, path_result, write_chunk, postprocess,
+                                        augment, unique, total)] = task
+                if len(futures) >= WINDOW_PER_WORKER * num_workers:
+                    break
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            # Record the chunks that did finish before raising the first failure
+            for future in done:
+                if future.exception() is None:
+                    yield futures.pop(future)
+            for future in done:
+                future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def generate_dataset(path_bank, specs, num_sample, path_result, seed=0, num_workers=None, space_btw_ab=1,
+                     chunk_size=CHUNK_SIZE, write_chunk=write_jpeg_chunk, postprocess=None, augment=None,
+                     unique=False):
+    """
+    Generate fraction images for a list of specs across a process pool.
+
+    Every chunk is rendered from its own seed derived from the master seed, so the
+    output is identical whatever the number of workers.
+
+    Args:
+        path_bank (str): Path to the digit bank file (loaded once per worker).
+        specs (list): Fraction specs, e.g. ['4/9', '4/92', '41/92'].
+        num_sample (int or dict): Samples per spec, or a dict mapping each spec to its count.
+        path_result (str): Directory to save the generated fraction images.
+        seed (int): Master seed.
+        num_workers (int): Worker processes; None uses every core, 0 or 1 runs in this process.
+        space_btw_ab (int): Space between the two digits of a two-digit line.
+        chunk_size (int): Samples per task.
+        write_chunk (callable): Called as write_chunk(path_result, spec, start, images, shapes) for every chunk.
+        postprocess (dict): Optional post-processing of every chunk, e.g. {'invert': True, 'blur': 0.5}
+            (keyword arguments of post_processing.postprocess_batch).
+        augment (dict): Optional random spacing, jitter, bar and affine augmentations, e.g.
+            fraction_augment.DEFAULT_AUGMENT; the parameters of every sample are saved with it.
+        unique (bool): Draw unique glyph combinations spread over every glyph pool (see
+            sampling_index.SamplingIndex) instead of independent random draws; at most
+            SamplingIndex.capacity() samples per spec (see sampling_index.balanced_counts).
+
+    Returns:
+        dict: Number of samples, elapsed seconds and samples per second.
+    """
+    os.makedirs(path_result, exist_ok=True)
+    tasks = plan_tasks(specs, num_sample, chunk_size)
+    if num_workers is None:
+        num_workers = os.cpu_count()
+
+    time_start = time.perf_counter()
+    counts = {spec: num_sample[spec] if isinstance(num_sample, dict) else num_sample for spec in specs}
+    completed = iter_completed_tasks(path_bank, tasks, seed, num_workers, space_btw_ab, path_result, write_chunk,
+                                     postprocess, augment, unique, counts)
+    num_done = sum(task[3] for task in completed)
+    elapsed = time.perf_counter() - time_start
+
+    stats = {'num_sample': num_done, 'seconds': elapsed, 'samples_per_sec': num_done / elapsed if elapsed else 0.0}
+    print('generated {} samples in {:.1f}s ({:.0f} samples/sec, {} workers)'.format(
+        num_done, elapsed, stats['samples_per_sec'], num_workers))
+    return stats
+
+
+if __name__ == '__main__':
+    # Settings: every a/b fraction, 100 samples each, on all cores
+    specs = [str(a) + '/' + str(b) for a in range(10) for b in range(10)]
+    num_sample = 100
+    seed = 0
+    path_data = './digits/processed/'
+    path_mnist = './Data/MNIST/'
+    path_bank = './digits/digit_bank.npz'
+    path_result = './fractions/'
+
+    # Build the bank here on first use, before the workers load it from path_bank
+    get_digit_bank(path_bank, path_data, path_mnist)
+    generate_dataset(path_bank, specs, num_sample, path_result, seed, write_chunk=write_shard_chunk)
@@ -0,0 +1,187 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+import numpy as np
+
+from fraction_batch import valid_mask
+import profiling
+
+# Number of files converted per task by convert_directory
+CHUNK_SIZE = 256
+
+# Image files picked up by convert_directory
+IMAGE_EXTENSIONS = ('.jpg', '.png')
+
+
+def _gaussian_kernel(sigma):
+    radius = max(1, int(np.ceil(3 * sigma)))
+    x = np.arange(-radius, radius + 1, dtype=np.float32)
+    kernel = np.exp(-x * x / (2 * sigma * sigma))
+    return kernel / kernel.sum()
+
+
+def _convolve(array, kernel, axis):
+    """Convolve a (n, H, W) float array with a 1D kernel along one image axis, zero padded."""
+    radius = len(kernel) // 2
+    pad = [(0, 0)] * array.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(array, pad)
+    out = np.zeros_like(array)
+    length = array.shape[axis]
+    for k, weight in enumerate(kernel):
+        out += weight * padded.take(np.arange(k, k + length), axis=axis)
+    return out
+
+
+def gaussian_blur(pixels, sigma, mask=None):
+    """
+    Blur a batch with a separable Gaussian kernel.
+
+    With a mask, only the masked pixels contribute (normalized convolution), so the
+    padding of a batch does not darken the edges of the smaller images.
+
+    Args:
+        pixels (np.array): float32 array of shape (n, H, W).
+        sigma (float): Standard deviation of the kernel in pixels.
+        mask (np.array): Optional bool array of shape (n, H, W).
+
+    Returns:
+        np.array: Blurred float32 array.
+    """
+    kernel = _gaussian_kernel(sigma)
+    if mask is None:
+        mask = np.ones(pixels.shape, dtype=bool)
+    weights = mask.astype(np.float32)
+    blurred = _convolve(_convolve(pixels * weights, kernel, 1), kernel, 2)
+    norm = _convolve(_convolve(weights, kernel, 1), kernel, 2)
+    return np.divide(blurred, norm, out=np.zeros_like(blurred), where=norm > 0)
+
+
+def postprocess_batch(images, shapes=None, rng=None, invert=False, contrast=None, blur=None, noise=None,
+                      binarize=None):
+    """
+    Apply paper-like post-processing to a whole padded batch at once.
+
+    The steps run in the order of the arguments: contrast, blur, noise, binarize,
+    then invert. Only the valid (rows, cols) of every image are processed; the
+    padding is left at zero. With invert only, the result is exactly 255 - x, as
+    ImageOps.invert gives for grayscale images.
+
+    Args:
+        images (np.array): Padded (n, H, W) uint8 batch, e.g. returned by render_batch.
+        shapes (np.array): Valid (rows, cols) of each image; defaults to the full (H, W).
+        rng (np.random.Generator): Random generator for the noise (a fresh unseeded one by default).
+        invert (bool): Invert the colours (white ink on black becomes black ink on white).
+        contrast (float): Scale the pixel values around mid-grey (128) by this factor.
+        blur (float): Standard deviation of a Gaussian blur, in pixels.
+        noise (float): Standard deviation of additive Gaussian noise, in grey levels.
+        binarize (int): Set pixels above this value to 255 and the others to 0.
+
+    Returns:
+        np.array: New (n, H, W) uint8 batch.
+    """
+    images = np.asarray(images)
+    mask = None if shapes is None else valid_mask(np.asarray(shapes).reshape(-1, 2), images.shape[1:])
+
+    if contrast is None and blur is None and noise is None and binarize is None:
+        out = 255 - images if invert else images.copy()
+    else:
+        pixels = images.astype(np.float32)
+        if contrast is not None:
+            pixels = (pixels - 128.0) * contrast + 128.0
+        if blur:
+            pixels = gaussian_blur(pixels, blur, mask)
+        if noise:
+            if rng is None:
+                rng = np.random.default_rng()
+            pixels += rng.normal(0.0, noise, size=pixels.shape).astype(np.float32)
+        if binarize is not None:
+            pixels = np.where(pixels > binarize, 255.0, 0.0)
+        np.clip(pixels, 0, 255, out=pixels)
+        out = np.rint(pixels).astype(np.uint8)
+        if invert:
+            np.subtract(255, out, out=out)
+
+    if mask is not None:
+        out[~mask] = 0
+    return out
+
+
+def _decode_bands(input_path):
+    """Decode an image into its mode and one uint8 array per band (L or RGB, like ImageOps.invert)."""
+    with Image.open(input_path) as img:
+        if img.mode not in ('L', 'RGB'):
+            img = img.convert('RGB')
+        return img.mode, [np.array(band) for band in img.split()]
+
+
+def _convert_chunk(pairs, seed, chunk_index, options):
+    """Decode a chunk of files into one padded batch of bands, post-process it and save every image."""
+    # Every band of every file becomes one image of the batch, so RGB inputs keep their mode
+    modes, arrays = [], []
+    for input_path, _ in pairs:
+        with profiling.stage('decode'):
+            mode, bands = _decode_bands(input_path)
+        modes.append(mode)
+        arrays.extend(bands)
+    shapes = np.array([a.shape for a in arrays], dtype=np.int64).reshape(-1, 2)
+    images = np.zeros((len(arrays),) + tuple(shapes.max(axis=0)), dtype=np.uint8)
+    for image, array in zip(images, arrays):
+        image[:array.shape[0], :array.shape[1]] = array
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk_index,)))
+    with profiling.stage('postprocess'):
+        images = postprocess_batch(images, shapes, rng, **options)
+    with profiling.stage('save'):
+        index = 0
+        for (_, output_path), mode in zip(pairs, modes):
+            row_num, col_num = shapes[index]
+            bands = [Image.fromarray(np.ascontiguousarray(image[:row_num, :col_num]), 'L')
+                     for image in images[index:index + len(mode)]]
+            Image.merge(mode, bands).save(output_path)
+            index += len(mode)
+    profiling.count('images', len(pairs))
+    return len(pairs)
+
+
+def convert_directory(input_directory, output_directory, num_workers=None, chunk_size=CHUNK_SIZE, seed=0,
+                      **options):
+    """
+    Post-process every image of a directory tree in chunks across a process pool.
+
+    The tree structure and file names are kept. Grayscale and RGB images keep their
+    mode (every channel is processed); other modes are converted to RGB first, as
+    ImageOps.invert only supports L and RGB. Files are listed in sorted order and
+    chunk k is seeded from (seed, k), so noisy outputs do not depend on num_workers.
+
+    Args:
+        input_directory (str): Root of the images to convert.
+        output_directory (str): Root of the converted images.
+        num_workers (int): Worker processes; None uses every core, 0 or 1 runs in this process.
+        chunk_size (int): Files per task.
+        seed (int): Master seed of the noise.
+        **options: Steps passed on to postprocess_batch, e.g. invert=True.
+
+    Returns:
+        int: Number of converted images.
+    """
+    # Walk through the input directory tree and create the corresponding output directories
+    pairs = []
+    for root, dirs, files in os.walk(input_directory):
+        dirs.sort()
+        output_root = os.path.join(output_directory, os.path.relpath(root, input_directory))
+        images = [f for f in sorted(files) if f.endswith(IMAGE_EXTENSIONS)]
+        if images:
+            os.makedirs(output_root, exist_ok=True)
+        pairs.extend((os.path.join(root, f), os.path.join(output_root, f)) for f in images)
+
+    chunks = [pairs[start:start + chunk_size] for start in range(0, len(pairs), chunk_size)]
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    if num_workers <= 1:
+        return sum(_convert_chunk(chunk, seed, i, options) for i, chunk in enumerate(chunks))
+
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = [executor.submit(_convert_chunk, chunk, seed, i, options) for i, chunk in enumerate(chunks)]
+        return sum(future.result() for future in futures)
@@ -0,0 +1,260 @@
+import atexit
+import collections
+import json
+import multiprocessing.util
+import os
+import sys
+import threading
+import time
+
+# Setting this environment variable to a file path enables profiling in every process
+# (workers included) and appends their stats to that file as JSON lines
+PROFILE_ENV = 'FRACTION_PROFILE'
+
+# Optional sampling interval of the sampling profiler, in seconds, e.g. FRACTION_PROFILE_SAMPLE=0.005
+PROFILE_SAMPLE_ENV = 'FRACTION_PROFILE_SAMPLE'
+
+# Seconds between two stats lines of a long run
+INTERVAL = 10.0
+
+# Number of most sampled frames written in every stats line
+TOP_FRAMES = 20
+
+
+class _NullStage:
+    """Context manager that does nothing; returned by stage() while profiling is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_time(self.name, time.perf_counter() - self.time_start)
+        return False
+
+
+class SamplingProfiler:
+    """
+    Background thread recording the innermost frame of one thread at a fixed interval.
+
+    Attributes:
+        samples (collections.Counter): Number of samples of every 'file:line function'.
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = threading.main_thread().ident if thread_id is None else thread_id
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                code = frame.f_code
+                self.samples['{}:{} {}'.format(os.path.basename(code.co_filename), frame.f_lineno, code.co_name)] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def top(self, n=TOP_FRAMES):
+        """Return the n most sampled frames as (frame, count) pairs."""
+        return self.samples.most_common(n)
+
+
+class Profiler:
+    """
+    Per-stage timers and counters of one process, written out periodically as JSON lines.
+
+    Every line holds the totals since the profiler started:
+        {"time": ..., "pid": ..., "elapsed": ..., "stages": {"compose": {"count": ..., "seconds": ...,
+         "mean_ms": ...}, ...}, "counters": {...}, "samples": [["file:line function", count], ...]}
+    """
+
+    def __init__(self, path_stats=None, interval=INTERVAL, sample_interval=None):
+        """
+        Args:
+            path_stats (str): JSON-lines file the stats are appended to; None only keeps them in memory.
+            interval (float): Seconds between two stats lines.
+            sample_interval (float): Start a SamplingProfiler with this interval (off by default).
+        """
+        self.path_stats = path_stats
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self._reset()
+
+    def _reset(self):
+        self.timers = {}
+        self.counters = {}
+        self.time_start = time.perf_counter()
+        self._time_emit = self.time_start
+        self._lock = threading.Lock()
+        self._closed = False
+        self.sampler = None
+        if self.sample_interval:
+            self.sampler = SamplingProfiler(self.sample_interval)
+            self.sampler.start()
+
+    def stage(self, name):
+        """Return a context manager adding the time spent in its block to a stage."""
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds, count=1):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0]
+            timer[0] += count
+            timer[1] += seconds
+        if time.perf_counter() - self._time_emit >= self.interval:
+            self.emit()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """Return the current totals as a dict (the content of a stats line)."""
+        with self._lock:
+            stages = {name: {'count': n, 'seconds': seconds, 'mean_ms': 1000.0 * seconds / n if n else 0.0}
+                      for name, (n, seconds) in self.timers.items()}
+            counters = dict(self.counters)
+        stats = {'time': time.time(), 'pid': os.getpid(), 'elapsed': time.perf_counter() - self.time_start,
+                 'stages': stages, 'counters': counters}
+        if self.sampler is not None:
+            stats['samples'] = self.sampler.top()
+        return stats
+
+    def emit(self):
+        """Append a stats line to path_stats."""
+        self._time_emit = time.perf_counter()
+        if self.path_stats is None:
+            return
+        line = json.dumps(self.snapshot()) + '\n'
+        # One short append per line, so the lines of several processes do not interleave
+        with open(self.path_stats, 'a') as f:
+            f.write(line)
+
+    def close(self):
+        """Stop the sampler and write the final stats line."""
+        if self._closed:
+            return
+        self._closed = True
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.emit()
+
+
+# Profiler of this process, or None while profiling is disabled
+_profiler = None
+
+
+def stage(name):
+    """
+    Time a block as one stage of the generation path:
+
+        with profiling.stage('compose'):
+            ...
+
+    While profiling is disabled this returns a shared no-op context manager.
+    """
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
+
+
+def count(name, n=1):
+    """Add n to a counter while profiling is enabled."""
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def get_profiler():
+    """Return the profiler of this process, or None."""
+    return _profiler
+
+
+def enable(path_stats=None, interval=INTERVAL, sample_interval=None):
+    """
+    Enable profiling in this process and in the worker processes it starts afterwards.
+
+    Args:
+        path_stats (str): JSON-lines file the stats are appended to.
+        interval (float): Seconds between two stats lines.
+        sample_interval (float): Also run a sampling profiler with this interval.
+
+    Returns:
+        Profiler: The new profiler.
+    """
+    global _profiler
+    disable()
+    _profiler = Profiler(path_stats, interval, sample_interval)
+    if path_stats is not None:
+        # Spawned workers enable themselves from the environment
+        os.environ[PROFILE_ENV] = path_stats
+        if sample_interval:
+            os.environ[PROFILE_SAMPLE_ENV] = str(sample_interval)
+    return _profiler
+
+
+def disable():
+    """
+    Disable profiling, writing the final stats line.
+
+    Returns:
+        Profiler: The profiler that was active, or None.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    os.environ.pop(PROFILE_ENV, None)
+    os.environ.pop(PROFILE_SAMPLE_ENV, None)
+    if profiler is not None:
+        profiler.close()
+    return profiler
+
+
+def _close_at_exit():
+    if _profiler is not None:
+        _profiler.close()
+
+
+def _reset_in_child():
+    # A forked process starts its own totals (and sampler thread) instead of repeating the parent's
+    if _profiler is not None:
+        _profiler._reset()
+
+
+def _register_finalizer(_):
+    multiprocessing.util.Finalize(None, _close_at_exit, exitpriority=100)
+
+
+# Pool workers leave through os._exit, which skips atexit; the multiprocessing finalizers
+# registered once the worker has started still run
+atexit.register(_close_at_exit)
+multiprocessing.util.register_after_fork(_NULL_STAGE, _register_finalizer)
+os.register_at_fork(after_in_child=_reset_in_child)
+
+if os.environ.get(PROFILE_ENV):
+    _profiler = Profiler(os.environ[PROFILE_ENV], INTERVAL, float(os.environ.get(PROFILE_SAMPLE_ENV) or 0) or None)
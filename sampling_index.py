@@ -0,0 +1,285 @@
+import zlib
+
+import numpy as np
+
+from fraction_batch import fitting_mask
+from fraction_layout import glyph_classes
+
+# Largest domain permuted at once; larger combination spaces are split into groups of glyph positions
+MAX_DOMAIN = 1 << 62
+
+# Rounds of the Feistel network of permute
+FEISTEL_ROUNDS = 4
+
+# Number of positions of the sampling order probed to estimate the share of fitting combinations
+PROBE_SIZE = 4096
+
+# Share of the estimated fitting combinations handed out by capacity, so that every chunk's slice
+# of the sampling order holds enough of them
+CAPACITY_MARGIN = 0.9
+
+
+def _round_function(x, key):
+    """splitmix64 finalizer of x + key, on uint64 arrays (wrapping arithmetic)."""
+    x = x + key
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def permute(values, domain, keys):
+    """
+    Apply a keyed pseudo-random permutation of [0, domain) to values.
+
+    A balanced Feistel network permutes the smallest even number of bits covering the
+    domain; values it sends outside of the domain are sent through it again (cycle
+    walking), which always ends inside the domain. Nothing is materialized, so the
+    domain can hold up to 2**62 values.
+
+    Args:
+        values (np.array): Integers in [0, domain).
+        domain (int): Size of the permuted range.
+        keys (np.array): uint64 round keys, one per round.
+
+    Returns:
+        np.array: uint64 array of the permuted values.
+    """
+    bits = max(2, (int(domain) - 1).bit_length())
+    bits += bits % 2
+    half = np.uint64(bits // 2)
+    mask = np.uint64((1 << (bits // 2)) - 1)
+    x = np.array(values, dtype=np.uint64)
+    todo = np.arange(len(x))
+    with np.errstate(over='ignore'):
+        while len(todo):
+            left, right = x[todo] >> half, x[todo] & mask
+            for key in keys:
+                left, right = right, left ^ (_round_function(right, key) & mask)
+            x[todo] = (left << half) | right
+            todo = todo[x[todo] >= np.uint64(domain)]
+    return x
+
+
+class SamplingIndex:
+    """
+    Keyed, stratified enumeration of the unique glyph combinations of one spec, without materializing them.
+
+    A combination takes one glyph per position (see fraction_layout.glyph_classes).
+    The positions of the sampling order come in blocks as long as the largest pool (the
+    lead position): inside a block the lead glyph runs through its whole pool while
+    every other glyph index is shifted along with it, and the block itself picks the
+    other glyphs through a keyed permutation of their combinations. Every pool is then
+    shuffled by its own keyed permutation. All of these maps are bijections, so the
+    first n positions are n distinct combinations; each block uses every glyph of the
+    lead pool exactly once and the other pools about evenly. The order only depends on
+    the seed and the spec, so any chunk of it can be drawn on its own.
+
+    sample_ids skips the combinations that do not fit their fraction, so glyphs that
+    rarely fit (very wide digits in a long line, for instance) are used less than the
+    others when a large share of the combinations does not fit.
+
+    Attributes:
+        classes (list): Class of every glyph position.
+        starts (np.array): First glyph id of the pool of every position.
+        sizes (np.array): Number of glyphs of the pool of every position.
+        num_combinations (int): Number of glyph combinations of the spec.
+        domain (int): Number of positions of the sampling order (num_combinations, at most about MAX_DOMAIN).
+    """
+
+    def __init__(self, bank, spec, seed=0):
+        """
+        Args:
+            bank (DigitBank): Packed digit glyphs.
+            spec (str): Fraction spec, e.g. '4/92'.
+            seed (int): Seed of the sampling order.
+        """
+        self.bank = bank
+        self.spec = spec
+        self.classes = glyph_classes(spec)
+        ranges = np.array([bank.class_range(c) for c in self.classes], dtype=np.int64)
+        self.starts = ranges[:, 0]
+        self.sizes = ranges[:, 1] - ranges[:, 0]
+        if (self.sizes <= 0).any():
+            raise ValueError('empty glyph class in {!r}'.format(spec))
+        self.num_combinations = int(np.prod([int(size) for size in self.sizes], dtype=object))
+        self.lead = int(np.argmax(self.sizes))
+        lead_size = int(self.sizes[self.lead])
+
+        # Group the other positions so that the combinations of every group fit in one permutation
+        self.groups = [[]]
+        group_size = 1
+        for position, size in enumerate(self.sizes):
+            if position == self.lead:
+                continue
+            if self.groups[-1] and group_size * int(size) > MAX_DOMAIN:
+                self.groups.append([])
+                group_size = 1
+            self.groups[-1].append(position)
+            group_size *= int(size)
+        self.group_sizes = [int(np.prod([int(self.sizes[p]) for p in group], dtype=object)) for group in self.groups]
+        self.num_blocks = min(self.num_combinations // lead_size, MAX_DOMAIN // lead_size)
+        self.domain = lead_size * self.num_blocks
+
+        seed_sequence = np.random.SeedSequence(seed, spawn_key=(zlib.crc32(str(spec).encode('ascii')),))
+        num_keys = 1 + len(self.groups) + len(self.sizes)
+        self.keys = seed_sequence.generate_state(FEISTEL_ROUNDS * num_keys, np.uint64).reshape(num_keys, FEISTEL_ROUNDS)
+
+    def combination(self, positions):
+        """
+        Return the glyph ids of the combinations at some positions of the sampling order.
+
+        Args:
+            positions (np.array): Positions in [0, domain).
+
+        Returns:
+            np.array: int64 array of shape (n, num_glyphs), in draw_glyph_ids order.
+        """
+        positions = np.asarray(positions, dtype=np.uint64)
+        lead_size = np.uint64(self.sizes[self.lead])
+        shift = positions % lead_size
+        indices = np.empty((len(positions), len(self.sizes)), dtype=np.uint64)
+        indices[:, self.lead] = shift
+
+        x = permute(positions // lead_size, self.num_blocks, self.keys[0])
+        for g, (group, group_size) in enumerate(zip(self.groups, self.group_sizes)):
+            if len(self.groups) == 1:
+                u = x
+            else:
+                # Higher groups only see part of their range before their own permutation spreads it
+                u = permute(x % np.uint64(group_size), group_size, self.keys[g + 1])
+                x = x // np.uint64(group_size)
+            for position in group:
+                size = np.uint64(self.sizes[position])
+                indices[:, position] = (u % size + shift) % size
+                u = u // size
+
+        ids = np.empty(indices.shape, dtype=np.int64)
+        for position, size in enumerate(self.sizes):
+            shuffled = permute(indices[:, position], int(size), self.keys[1 + len(self.groups) + position])
+            ids[:, position] = self.starts[position] + shuffled.astype(np.int64)
+        return ids
+
+    def capacity(self, space_btw_ab=1):
+        """
+        Return how many unique samples sample_ids can draw for this spec.
+
+        That is CAPACITY_MARGIN of the combinations that fit their fraction, their share
+        being measured on PROBE_SIZE positions spread over the sampling order (all of
+        them for smaller specs).
+
+        Args:
+            space_btw_ab (int): Space between the two digits of a two-digit line.
+        """
+        num_probe = min(self.domain, PROBE_SIZE)
+        positions = np.arange(num_probe, dtype=np.uint64) * np.uint64(self.domain // num_probe)
+        ok = fitting_mask(self.bank, self.spec, self.combination(positions), space_btw_ab)
+        return int(self.domain * ok.mean() * CAPACITY_MARGIN)
+
+    def sample_ids(self, start, count, total, space_btw_ab=1):
+        """
+        Draw samples [start, start + count) of total unique samples of the spec.
+
+        The sampling order is split in proportion to the samples: the samples
+        [start, start + count) own the positions [start * domain // total,
+        (start + count) * domain // total), and take the first count combinations of that
+        slice that fit their fraction. Slices of disjoint sample ranges are disjoint, so
+        the samples are unique across all chunks and any number of workers, and a total
+        up to capacity() spreads them over the whole combination space.
+
+        Args:
+            start (int): Index of the first sample.
+            count (int): Number of samples.
+            total (int): Number of samples of the spec in the whole run.
+            space_btw_ab (int): Space between the two digits of a two-digit line.
+
+        Returns:
+            np.array: int64 glyph ids of shape (count, num_glyphs).
+        """
+        if start + count > total or total > self.domain:
+            raise ValueError('samples [{}, {}) of {} do not fit the {} positions of {!r}'.format(
+                start, start + count, total, self.domain, self.spec))
+
+        # Walk forward through the slice until enough combinations fit
+        position = start * self.domain // total
+        stop = (start + count) * self.domain // total
+        found = []
+        num_found = 0
+        while num_found < count and position < stop:
+            size = min(stop - position, 2 * (count - num_found) + 64)
+            draw = self.combination(np.arange(size, dtype=np.uint64) + np.uint64(position))
+            draw = draw[fitting_mask(self.bank, self.spec, draw, space_btw_ab)][:count - num_found]
+            found.append(draw)
+            num_found += len(draw)
+            position += size
+        if num_found < count:
+            raise RuntimeError('only {} of samples [{}, {}) of {!r} fit their slice of the sampling order; '
+                               'draw at most capacity() samples'.format(num_found, start, start + count, self.spec))
+        return np.concatenate(found) if found else np.empty((0, len(self.sizes)), dtype=np.int64)
+
+
+def balanced_counts(bank, specs, total, space_btw_ab=1):
+    """
+    Split a number of samples evenly across specs (labels), capped at the unique samples of each.
+
+    The cap of a spec is SamplingIndex.capacity(): CAPACITY_MARGIN (90%) of its glyph
+    combinations that fit their fraction. What a spec with too few of them cannot take
+    is spread over the others.
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        specs (list): Fraction specs.
+        total (int): Total number of samples.
+        space_btw_ab (int): Space between the two digits of a two-digit line.
+
+    Returns:
+        dict: Number of samples of every spec, usable as the num_sample of generate_dataset.
+    """
+    limits = {spec: SamplingIndex(bank, spec).capacity(space_btw_ab) for spec in specs}
+    counts = dict.fromkeys(specs, 0)
+    left = total
+    open_specs = list(specs)
+    while left > 0 and open_specs:
+        share, extra = divmod(left, len(open_specs))
+        for i, spec in enumerate(list(open_specs)):
+            take = min(share + (i < extra), limits[spec] - counts[spec])
+            counts[spec] += take
+            left -= take
+            if counts[spec] == limits[spec]:
+                open_specs.remove(spec)
+    return counts
+
+
+def coverage_stats(bank, spec, ids):
+    """
+    Report how well a set of glyph combinations covers the glyph pools of a spec.
+
+    Works on the ids of any sampler, e.g. SamplingIndex.sample_ids or draw_glyph_ids.
+
+    Args:
+        bank (DigitBank): Packed digit glyphs.
+        spec (str): Fraction spec of the samples.
+        ids (np.array): Glyph ids of shape (n, num_glyphs).
+
+    Returns:
+        dict: Number of samples, unique combinations, duplicates, the fraction of the
+        combination space covered, and for every glyph position and every class the pool
+        size, the glyphs used, the fraction of the pool used and the least and most uses
+        of a glyph of the pool.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    classes = glyph_classes(spec)
+    num_unique = len(np.unique(ids, axis=0)) if len(ids) else 0
+    num_combinations = int(np.prod([bank.count(c) for c in classes], dtype=object))
+
+    def pool_stats(name, column_ids):
+        start, stop = bank.class_range(name)
+        uses = np.bincount(column_ids - start, minlength=stop - start)
+        used = int(np.count_nonzero(uses))
+        return {'class': str(name), 'pool': int(stop - start), 'used': used,
+                'fraction_used': used / (stop - start), 'min_uses': int(uses.min()), 'max_uses': int(uses.max())}
+
+    return {'spec': spec, 'samples': len(ids), 'unique': num_unique, 'duplicates': len(ids) - num_unique,
+            'combinations': num_combinations, 'coverage': num_unique / num_combinations,
+            'positions': [pool_stats(name, ids[:, j]) for j, name in enumerate(classes)],
+            'classes': {str(name): pool_stats(name, ids[:, [j for j, c in enumerate(classes) if c == name]].ravel())
+                        for name in dict.fromkeys(classes)}}